@@ -0,0 +1,87 @@
+import math
+import random
+import threading
+import time
+
+# Adaptive concurrency limit. Requests hold a slot while they run; when the
+# slots are taken, new ones are turned away at once (to retry later) rather
+# than queueing behind the rest. The limit follows measured latency: the
+# baseline is what requests take when they run (nearly) alone, and while
+# recent latency stays within `tolerance` times that the limit creeps up.
+# Once requests slow down past it, which means they are queueing for the
+# CPU, the limit is cut back in proportion.
+#
+# Lower priorities may only use part of the limit, so they are shed first
+# and the remaining headroom is kept for the requests that matter most.
+
+CRITICAL, NORMAL, LOW = 0, 1, 2
+
+
+class AdmissionLimiter:
+    def __init__(self, initial_limit=32, min_limit=4, max_limit=512, tolerance=2.0, smoothing=0.2,
+                 shares=(1.0, 0.75, 0.5), retry_after=(1, 2, 5)):
+        self.limit = initial_limit
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.tolerance = tolerance
+        self.smoothing = smoothing
+        self.shares = shares
+        self.retry_after = retry_after
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.rtt = None
+        self.baseline = None
+        self.admitted = [0] * len(shares)
+        self.shed = [0] * len(shares)
+
+    # A ticket to pass to release(), or None if the request is shed
+    def try_acquire(self, priority):
+        with self.lock:
+            if self.in_flight >= max(1, self.limit * self.shares[priority]):
+                self.shed[priority] += 1
+                return None
+            ticket = (time.monotonic(), self.in_flight)
+            self.in_flight += 1
+            self.admitted[priority] += 1
+        return ticket
+
+    def release(self, ticket):
+        started, concurrency = ticket
+        latency = time.monotonic() - started
+        with self.lock:
+            self.in_flight -= 1
+            self.update(latency, concurrency)
+
+    # Called with the lock held. `concurrency` is how many other requests
+    # were running when this one started
+    def update(self, latency, concurrency):
+        if self.rtt is None:
+            self.rtt = self.baseline = latency
+            return
+        self.rtt += (latency - self.rtt) * 0.1
+        if concurrency < 2:
+            self.baseline += (latency - self.baseline) * 0.05
+        gradient = max(0.5, min(1.0, self.tolerance * self.baseline / self.rtt))
+        # Only grow a limit that is actually being used
+        if gradient == 1.0 and self.in_flight < self.limit / 2:
+            return
+        target = self.limit * gradient + math.sqrt(self.limit)
+        limit = self.limit * (1 - self.smoothing) + target * self.smoothing
+        self.limit = max(self.min_limit, min(self.max_limit, limit))
+
+    # Seconds a shed client should wait, spread out so they don't all come
+    # back at the same moment
+    def retry_after_for(self, priority):
+        base = self.retry_after[priority]
+        return random.randint(base, base * 2)
+
+    def stats(self):
+        with self.lock:
+            return {
+                "limit": round(self.limit, 1),
+                "in_flight": self.in_flight,
+                "latency_ms": round((self.rtt or 0) * 1000, 2),
+                "baseline_ms": round((self.baseline or 0) * 1000, 2),
+                "admitted": list(self.admitted),
+                "shed": list(self.shed),
+            }
@@ -0,0 +1,263 @@
+import argparse
+import asyncio
+import os
+import pickle
+import re
+import shutil
+import signal
+import socket
+import struct
+import tempfile
+import zlib
+from urllib.parse import parse_qsl
+
+import uvicorn
+
+import v12
+import v12_asgi
+from codes import CodeAllocator
+
+# Runs N copies of v12_asgi on one port. Every process binds the port with
+# SO_REUSEPORT, so the kernel spreads connections across them, and each keeps
+# its own slice of `rooms`: a room lives on the process its code maps to.
+# A request that lands on another process is handed to the owner over a Unix
+# socket, as the ASGI messages themselves, and its response (or WebSocket)
+# is relayed back the same way.
+#
+#   python cluster.py --processes 8 --port 5000
+#
+# A room's owner is its code modulo the process count, and each process only
+# hands out codes it owns; requests are routed on the room in the path
+# (/rooms/<code>/..., /api/rooms/<code>/...), the ?room= of /state, the
+# room_code of a join, and otherwise the room in the session cookie.
+#
+# SIGTERM to this parent stops every worker gracefully; each saves its rooms
+# as one part of the v12 snapshot, and the next start (of any process count,
+# or of a single v12 server) deals them out to their new owners.
+
+processes = 1
+worker_index = 0
+run_dir = None
+
+ROOM_PATH = re.compile(r'^(?:/api)?/rooms/([^/]+)/')
+
+# Keys of an ASGI scope that make sense in another process
+FORWARDED_SCOPE = ('type', 'asgi', 'http_version', 'method', 'scheme', 'path', 'raw_path', 'query_string',
+                   'root_path', 'headers', 'client', 'server', 'subprotocols')
+
+
+# Codes that aren't numbers (e.g. mistyped into the join form) still need a
+# process to answer that there is no such room
+def owner_of(room_code):
+    room_code = str(room_code)
+    if room_code.isdigit():
+        return int(room_code) % processes
+    return zlib.crc32(room_code.encode()) % processes
+
+def peer_path(index):
+    return os.path.join(run_dir, f"worker-{index}.sock")
+
+# proto must be IPPROTO_TCP (not the default 0) for asyncio to set
+# TCP_NODELAY on the connections it accepts
+def listen(host, port, backlog):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM, socket.IPPROTO_TCP)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    return sock
+
+
+# Messages between processes are length-prefixed pickles; both ends are our
+# own workers, talking through a directory only this user can open
+async def write_frame(writer, message):
+    data = pickle.dumps(message)
+    writer.write(struct.pack('!I', len(data)) + data)
+    await writer.drain()
+
+async def read_frame(reader):
+    try:
+        size, = struct.unpack('!I', await reader.readexactly(4))
+        return pickle.loads(await reader.readexactly(size))
+    except (asyncio.IncompleteReadError, ConnectionError):
+        return None
+
+
+# The room a request belongs to, or None when any process can answer it.
+# Returns the receive callable to use from then on, since reading a join's
+# form consumes the body
+async def room_of(scope, receive):
+    match = ROOM_PATH.match(scope['path'])
+    if match:
+        return match.group(1), receive
+    query = dict(parse_qsl(scope['query_string'].decode('latin-1')))
+    if scope['path'] == '/state' and query.get('room'):
+        return query['room'], receive
+    if scope['type'] == 'http' and scope['method'] == 'POST' and scope['path'] == '/multiplayer':
+        body = await v12_asgi.read_body(receive)
+        receive = replay(body or b'', receive)
+        form = dict(parse_qsl((body or b'').decode()))
+        if form.get('action') == 'join':
+            return form.get('room_code'), receive
+        if form.get('action') == 'create':
+            return None, receive
+    cookie = dict(scope['headers']).get(b'cookie', b'').decode('latin-1')
+    return v12_asgi.load_session(cookie).get('room'), receive
+
+def replay(body, receive):
+    pending = [{'type': 'http.request', 'body': body, 'more_body': False}]
+    async def replayed():
+        if pending:
+            return pending.pop()
+        return await receive()
+    return replayed
+
+async def app(scope, receive, send):
+    if scope['type'] in ('http', 'websocket'):
+        room_code, receive = await room_of(scope, receive)
+        if room_code is not None and owner_of(room_code) != worker_index:
+            await forward(owner_of(room_code), scope, receive, send)
+            return
+    await v12_asgi.app(scope, receive, send)
+
+# Relay one request to the owner: our client's messages go up, the owner's
+# replies come back down until the owner hangs up
+async def forward(owner, scope, receive, send):
+    try:
+        reader, writer = await asyncio.open_unix_connection(peer_path(owner))
+    except OSError:
+        if scope['type'] == 'websocket':
+            await send({'type': 'websocket.close', 'code': 1011})
+        else:
+            await send({'type': 'http.response.start', 'status': 503, 'headers': [(b'retry-after', b'1')]})
+            await send({'type': 'http.response.body', 'body': b'Room owner unavailable'})
+        return
+
+    async def upload():
+        while True:
+            message = await receive()
+            await write_frame(writer, message)
+            if message['type'] in ('http.disconnect', 'websocket.disconnect'):
+                return
+
+    await write_frame(writer, {key: scope[key] for key in FORWARDED_SCOPE if key in scope})
+    uploading = asyncio.ensure_future(upload())
+    try:
+        while True:
+            message = await read_frame(reader)
+            if message is None:
+                break
+            await send(message)
+    finally:
+        uploading.cancel()
+        await asyncio.gather(uploading, return_exceptions=True)
+        writer.close()
+
+# The owner's end: run the app on a forwarded scope. When the forwarding
+# process hangs up, the app sees its client disconnect
+async def serve_peer(reader, writer):
+    scope = await read_frame(reader)
+    if scope is None:
+        writer.close()
+        return
+    if scope['type'] == 'websocket':
+        hangup = {'type': 'websocket.disconnect', 'code': 1006}
+    else:
+        hangup = {'type': 'http.disconnect'}
+    inbox = asyncio.Queue()
+
+    async def download():
+        while True:
+            message = await read_frame(reader)
+            if message is None:
+                break
+            inbox.put_nowait(message)
+        inbox.put_nowait(hangup)
+
+    async def receive():
+        message = await inbox.get()
+        if message['type'].endswith('disconnect'):
+            inbox.put_nowait(message)
+        return message
+
+    async def send(message):
+        await write_frame(writer, message)
+
+    downloading = asyncio.ensure_future(download())
+    try:
+        await v12_asgi.app(scope, receive, send)
+    except ConnectionError:
+        pass
+    finally:
+        downloading.cancel()
+        writer.close()
+
+
+# `snapshot` is every room saved by the last run, whatever its process
+# count was; each worker takes the rooms it owns now and saves its own part
+def run_worker(index, args, snapshot):
+    global worker_index
+    worker_index = index
+    v12.codes = CodeAllocator(part=(index, processes))
+    v12.load_rooms([data for data in snapshot if owner_of(data["c"]) == index])
+    base, extension = os.path.splitext(v12.SNAPSHOT_PATH)
+    v12_asgi.snapshot_path = f"{base}-{index}{extension}"
+
+    async def serve():
+        await asyncio.start_unix_server(serve_peer, peer_path(index))
+        config = uvicorn.Config(app, timeout_keep_alive=args.keepalive, backlog=args.backlog,
+                                timeout_graceful_shutdown=v12.DRAIN_TIMEOUT, log_level="warning")
+        await v12_asgi.Server(config).serve(sockets=[listen(args.host, args.port, args.backlog)])
+
+    asyncio.run(serve())
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Serve v12 from several processes sharing one port")
+    parser.add_argument('--processes', type=int, default=os.cpu_count(),
+                        help="server processes; each owns the rooms whose code hashes to it")
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--keepalive', type=int, default=5,
+                        help="seconds an idle keep-alive connection is held open")
+    parser.add_argument('--backlog', type=int, default=4096,
+                        help="listen backlog of each process")
+    return parser
+
+
+def main(argv=None):
+    global processes, run_dir
+    args = build_parser().parse_args(argv)
+    processes = args.processes
+    run_dir = tempfile.mkdtemp(prefix='tictactoe-')
+    snapshot = v12.read_snapshot()
+
+    children = []
+    for index in range(processes):
+        pid = os.fork()
+        if pid == 0:
+            try:
+                run_worker(index, args, snapshot)
+            finally:
+                os._exit(0)
+        children.append(pid)
+
+    # Ctrl+C reaches the workers from the terminal; a SIGTERM for the
+    # cluster is passed on to each of them
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, lambda signum, frame: [os.kill(pid, signal.SIGTERM) for pid in children])
+    print(f"🚀 Serving v12 from {processes} processes on port {args.port}")
+    try:
+        for pid in children:
+            while True:
+                try:
+                    os.waitpid(pid, 0)
+                    break
+                except InterruptedError:
+                    continue
+    finally:
+        shutil.rmtree(run_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
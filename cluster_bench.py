@@ -0,0 +1,119 @@
+import argparse
+import http.client
+import json
+import multiprocessing
+import os
+import random
+import subprocess
+import sys
+import time
+import urllib.parse
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# Throughput of cluster.py as processes are added: for each process count a
+# fresh cluster is started and a fleet of client processes, each seating two
+# players in its own room, plays random games through the JSON API for a
+# fixed time. Each seat keeps one keep-alive connection, which the kernel
+# assigns to an arbitrary process, so most moves also pay for the hop to the
+# room's owner.
+#
+#   python cluster_bench.py --processes 1 2 4 8 --clients 32 --seconds 10
+
+
+class Seat:
+    def __init__(self, port, nickname):
+        self.connection = http.client.HTTPConnection('127.0.0.1', port)
+        self.cookie = ''
+        self.request('POST', '/', urllib.parse.urlencode({'nickname': nickname}),
+                     {'Content-Type': 'application/x-www-form-urlencoded'})
+
+    def request(self, method, path, body=None, headers=None):
+        headers = dict(headers or {}, Cookie=self.cookie)
+        self.connection.request(method, path, body, headers)
+        response = self.connection.getresponse()
+        data = response.read()
+        cookie = response.getheader('Set-Cookie')
+        if cookie:
+            self.cookie = cookie.split(';')[0]
+        return response.status, data
+
+    def form(self, path, **fields):
+        return self.request('POST', path, urllib.parse.urlencode(fields),
+                            {'Content-Type': 'application/x-www-form-urlencoded'})
+
+    def api(self, path, command=None):
+        status, data = self.request('POST', path, json.dumps(command or {}), {'Content-Type': 'application/json'})
+        return json.loads(data)
+
+
+def play(port, seconds, results):
+    host, guest = Seat(port, 'bench-x'), Seat(port, 'bench-o')
+    host.form('/multiplayer', action='create')
+    room = json.loads(host.request('GET', '/game', headers={'Accept': 'application/json'})[1])['room']
+    guest.form('/multiplayer', action='join', room_code=room)
+    seats = {'bench-x': host, 'bench-o': guest}
+
+    moves = 0
+    state = host.api(f'/api/rooms/{room}/restart')
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        if 'r' in state:
+            state = host.api(f'/api/rooms/{room}/restart')
+            continue
+        cell = random.choice([i for i, mark in enumerate(state['b']) if mark == ' '])
+        state = seats[state['t']].api(f'/api/rooms/{room}/moves', {'cell': cell})
+        moves += 1
+    host.request('GET', '/exit')
+    guest.request('GET', '/exit')
+    results.put(moves)
+
+
+def wait_until_up(port, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=1)
+            connection.request('GET', '/metrics')
+            connection.getresponse().read()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise SystemExit(f"cluster on port {port} did not come up")
+
+
+def run(processes, args):
+    server = subprocess.Popen([sys.executable, os.path.join(HERE, 'cluster.py'), '--processes', str(processes),
+                               '--port', str(args.port)], stdout=subprocess.DEVNULL)
+    try:
+        wait_until_up(args.port)
+        # Give every process time to bind before the clients connect
+        time.sleep(1)
+        results = multiprocessing.Queue()
+        clients = [multiprocessing.Process(target=play, args=(args.port, args.seconds, results))
+                   for _ in range(args.clients)]
+        for client in clients:
+            client.start()
+        moves = sum(results.get() for _ in clients)
+        for client in clients:
+            client.join()
+        return moves / args.seconds
+    finally:
+        server.terminate()
+        server.wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark cluster.py throughput across process counts")
+    parser.add_argument('--processes', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--clients', type=int, default=32, help="client processes, one room each")
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--port', type=int, default=5050)
+    args = parser.parse_args()
+
+    print(f"{os.cpu_count()} cores, {args.clients} rooms, {args.seconds:g}s per run")
+    baseline = None
+    for processes in args.processes:
+        rate = run(processes, args)
+        baseline = baseline or rate
+        print(f"{processes:>3} processes: {rate:>8.0f} moves/s  ({rate / baseline:.2f}x)")
@@ -0,0 +1,81 @@
+import threading
+import time
+
+# Single-flight render cache. The first request for a key renders it;
+# requests for the same key that arrive while that render is running wait
+# for its result instead of rendering again, and for `ttl` seconds afterwards
+# the result is served from memory. Keys are expected to carry a version, so
+# a cached entry never goes stale - the ttl only bounds memory.
+
+
+class Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class Coalescer:
+    def __init__(self, ttl=2.0, max_entries=4096):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.cache = {}
+        self.flights = {}
+        self.renders = 0
+        self.coalesced = 0
+        self.hits = 0
+
+    def get(self, key, render):
+        now = time.monotonic()
+        with self.lock:
+            entry = self.cache.get(key)
+            if entry is not None and now - entry[1] < self.ttl:
+                self.hits += 1
+                return entry[0]
+            flight = self.flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self.flights[key] = Flight()
+                self.renders += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+
+        try:
+            flight.value = render()
+        except BaseException as error:
+            flight.error = error
+            raise
+        finally:
+            with self.lock:
+                del self.flights[key]
+                if flight.error is None:
+                    self.store(key, flight.value, time.monotonic())
+            flight.done.set()
+        return flight.value
+
+    # Called with the lock held. Drops expired entries from the front (oldest
+    # first) and, if still full, the oldest live one
+    def store(self, key, value, now):
+        self.cache.pop(key, None)
+        while self.cache:
+            oldest = next(iter(self.cache))
+            if now - self.cache[oldest][1] < self.ttl and len(self.cache) < self.max_entries:
+                break
+            del self.cache[oldest]
+        self.cache[key] = (value, now)
+
+    def stats(self):
+        with self.lock:
+            return {
+                "renders": self.renders,
+                "coalesced": self.coalesced,
+                "hits": self.hits,
+                "cached": len(self.cache),
+            }
@@ -0,0 +1,87 @@
+import random
+import threading
+from collections import deque
+
+# Room codes without collisions. Every code of the current length is handed
+# out once, in an order that looks random, before any is reused: the n-th
+# code is n pushed through a keyed permutation of the code space (a small
+# Feistel network, walked until it lands inside the space), so drawing one
+# costs the same however many rooms are open and nothing has to be stored
+# for the codes not handed out yet. Released codes queue up and are reused
+# oldest first once the fresh ones run out.
+#
+# When fewer than `low_water` of the codes are left, the length grows by a
+# digit and the larger space starts over; codes already handed out keep
+# working, shorter ones just aren't reused.
+#
+# `part=(index, count)` restricts the codes to those equal to `index` modulo
+# `count`, for a server process that owns that share of them.
+
+
+class CodeAllocator:
+    def __init__(self, digits=4, low_water=0.25, part=(0, 1)):
+        self.low_water = low_water
+        self.part = part
+        self.lock = threading.Lock()
+        self.in_use = set()
+        self.free = deque()
+        self.start(digits)
+
+    def start(self, digits):
+        index, count = self.part
+        lowest = 10 ** (digits - 1)
+        self.digits = digits
+        self.first = lowest + (index - lowest) % count
+        self.size = len(range(self.first, 10 ** digits, count))
+        self.drawn = 0
+        self.free.clear()
+        bits = max(2, (self.size - 1).bit_length())
+        self.half = (bits + 1) // 2
+        self.keys = [random.getrandbits(32) for _ in range(4)]
+
+    def left(self):
+        return self.size - self.drawn + len(self.free)
+
+    def allocate(self):
+        with self.lock:
+            while True:
+                if self.left() < self.low_water * self.size:
+                    self.start(self.digits + 1)
+                if self.drawn < self.size:
+                    code = str(self.first + self.permute(self.drawn) * self.part[1])
+                    self.drawn += 1
+                else:
+                    code = self.free.popleft()
+                # Skips codes restored from a snapshot with claim()
+                if code not in self.in_use:
+                    self.in_use.add(code)
+                    return code
+
+    def release(self, code):
+        with self.lock:
+            if code in self.in_use:
+                self.in_use.remove(code)
+                if len(code) == self.digits:
+                    self.free.append(code)
+
+    # Mark a code that is already taken, e.g. by a room restored at startup
+    def claim(self, code):
+        with self.lock:
+            self.in_use.add(code)
+
+    def permute(self, index):
+        while True:
+            index = self.feistel(index)
+            if index < self.size:
+                return index
+
+    def feistel(self, value):
+        mask = (1 << self.half) - 1
+        left, right = value >> self.half, value & mask
+        for key in self.keys:
+            left, right = right, left ^ (hash((right, key)) & mask)
+        return (left << self.half) | right
+
+    def stats(self):
+        with self.lock:
+            return {"digits": self.digits, "in_use": len(self.in_use), "left": self.left()}
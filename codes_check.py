@@ -0,0 +1,131 @@
+import argparse
+
+from codes import CodeAllocator
+
+# Checks for CodeAllocator's promises, run against fresh allocators:
+#   - every code of a length is drawn at most once before the length grows,
+#     and stays inside the code space
+#   - the length grows by a digit once fewer than low_water of the codes
+#     are left, and codes of the old length are neither drawn nor queued
+#     for reuse afterwards
+#   - released codes come back oldest first, and only after every fresh
+#     code has been drawn
+#   - a code claim()ed before it was drawn is never handed out
+#   - the shares of part=(index, count) are disjoint and hold only codes
+#     that cluster.py's owner_of() routes to that worker
+# Exits non-zero if any of them fails.
+#
+#   python codes_check.py --rounds 20
+
+
+# How many codes a fresh allocator draws before it grows: until fewer than
+# low_water of them are left
+def codes_before_growth(allocator):
+    return int(allocator.size - allocator.low_water * allocator.size) + 1
+
+def draw_length(allocator):
+    digits = allocator.digits
+    drawn = []
+    while True:
+        code = allocator.allocate()
+        if len(code) != digits:
+            return drawn, code
+        drawn.append(code)
+
+def check_unique(allocator):
+    size = allocator.size
+    expected = codes_before_growth(allocator)
+    drawn = draw_length(allocator)[0]
+    problems = []
+    if len(set(drawn)) != len(drawn):
+        problems.append(f"{len(drawn) - len(set(drawn))} codes drawn twice")
+    if any(not 1000 <= int(code) <= 9999 for code in drawn):
+        problems.append("a code outside 1000-9999")
+    if len(drawn) != expected:
+        problems.append(f"grew after {len(drawn)} of {size} codes")
+    return problems
+
+def check_growth(allocator):
+    digits = allocator.digits
+    drawn = [allocator.allocate() for _ in range(10)]
+    # Queued for reuse, then forgotten when the length grows
+    for code in drawn[:5]:
+        allocator.release(code)
+    grown = draw_length(allocator)[1]
+    problems = []
+    if len(grown) != digits + 1 or allocator.digits != digits + 1:
+        problems.append(f"grew to {allocator.digits} digits, drew {grown}")
+    allocator.release(drawn[5])
+    if drawn[5] in allocator.free:
+        problems.append("a code of the old length was queued for reuse")
+    expected = codes_before_growth(allocator)
+    longer, next_grown = draw_length(allocator)
+    if len(next_grown) != digits + 2:
+        problems.append(f"drew {next_grown} after growing to {digits + 1} digits")
+    elif len(longer) + 1 != expected:
+        problems.append(f"drew {len(longer) + 1} codes of {digits + 1} digits before growing again, expected {expected}")
+    return problems
+
+def check_reuse(allocator):
+    problems = []
+    drawn = [allocator.allocate() for _ in range(allocator.size - 20)]
+    released = drawn[:10]
+    for code in released:
+        allocator.release(code)
+    fresh = [allocator.allocate() for _ in range(20)]
+    if set(fresh) & set(released):
+        problems.append("a released code came back before the fresh ones ran out")
+    reused = [allocator.allocate() for _ in range(5)]
+    if reused != released[:5]:
+        problems.append(f"reused {reused}, expected {released[:5]}")
+    return problems
+
+def check_claim(allocator):
+    claimed = str(allocator.first + allocator.permute(allocator.size // 2))
+    allocator.claim(claimed)
+    expected = codes_before_growth(allocator) - 1
+    drawn = draw_length(allocator)[0]
+    problems = []
+    if claimed in drawn:
+        problems.append(f"claimed code {claimed} was drawn")
+    if len(drawn) != expected:
+        problems.append(f"drew {len(drawn)} codes around one claimed, expected {expected}")
+    return problems
+
+def check_shares(count):
+    allocators = [CodeAllocator(part=(index, count)) for index in range(count)]
+    expected = [codes_before_growth(allocator) for allocator in allocators]
+    shares = [set(draw_length(allocator)[0]) for allocator in allocators]
+    problems = []
+    for index, share in enumerate(shares):
+        if any(int(code) % count != index for code in share):
+            problems.append(f"share {index} of {count} holds codes owned by another worker")
+        for other in shares[index + 1:]:
+            if share & other:
+                problems.append(f"share {index} of {count} overlaps another")
+        if len(share) != expected[index]:
+            problems.append(f"share {index} of {count} drew {len(share)} codes, expected {expected[index]}")
+    return problems
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check CodeAllocator's invariants")
+    parser.add_argument('--rounds', type=int, default=20, help="times to repeat each check, with new keys")
+    args = parser.parse_args()
+
+    checks = [
+        ("no repeats before growing", lambda: check_unique(CodeAllocator())),
+        ("grows past the low-water mark", lambda: check_growth(CodeAllocator(digits=2, low_water=0.05))),
+        ("released codes reused last, oldest first", lambda: check_reuse(CodeAllocator(digits=2, low_water=0.05))),
+        ("claimed codes skipped", lambda: check_claim(CodeAllocator(digits=2, low_water=0.05))),
+        ("worker shares disjoint", lambda: check_shares(3) + check_shares(4)),
+    ]
+    failed = 0
+    for label, check in checks:
+        problems = {problem for _ in range(args.rounds) for problem in check()}
+        failed += bool(problems)
+        print(f"{'FAIL' if problems else 'ok':>4}  {label}")
+        for problem in sorted(problems):
+            print(f"        {problem}")
+    if failed:
+        raise SystemExit(f"{failed} of {len(checks)} checks failed")
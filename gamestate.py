@@ -0,0 +1,140 @@
+from collections.abc import Mapping
+from enum import Enum
+
+# The state of one game, kept small because a server holds one per room.
+# The board is two 9-bit ints, the cells X holds and the cells O holds (bit
+# n for cell n), the players are a tuple whose index is the seat (seat 0
+# plays X), and whose turn it is and who won or left are seat numbers.
+#
+# A player has won when one of their boards covers a line's mask, so a move
+# only has to test the masks of the lines through its cell, and the board is
+# full when X and O hold nine bits between them.
+#
+# It reads like the dict the pages used to get: state["board"] is a list of
+# marks, state["current_player"] a nickname and so on, computed on each
+# lookup. Changes go through play() and abandon().
+
+class Status(Enum):
+    PLAYING = "playing"
+    WON = "won"
+    DRAW = "draw"
+    ABANDONED = "abandoned"
+
+MARKS = ('', 'X', 'O')
+
+WIN_LINES = ((0, 1, 2), (3, 4, 5), (6, 7, 8),
+             (0, 3, 6), (1, 4, 7), (2, 5, 8),
+             (0, 4, 8), (2, 4, 6))
+
+CELLS = range(9)
+BITS = tuple(1 << cell for cell in CELLS)
+WIN_MASKS = tuple(BITS[a] | BITS[b] | BITS[c] for a, b, c in WIN_LINES)
+MASKS_THROUGH = tuple(tuple(mask for mask in WIN_MASKS if mask & bit) for bit in BITS)
+
+KEYS = ("board", "current_turn", "game_over", "result", "symbols", "players", "current_player")
+
+
+class GameState(Mapping):
+    __slots__ = ('players', 'x', 'o', 'turn', 'status', 'seat')
+
+    def __init__(self, players, x=0, o=0, turn=0):
+        self.players = tuple(players)
+        self.x = x
+        self.o = o
+        self.turn = turn
+        self.status = Status.PLAYING
+        # The seat that won, or that left the game
+        self.seat = None
+
+    # A board as written in snapshots: 9 chars, ' ' for empty
+    @classmethod
+    def load(cls, players, text, turn_mark):
+        x = sum(BITS[cell] for cell, mark in enumerate(text) if mark == 'X')
+        o = sum(BITS[cell] for cell, mark in enumerate(text) if mark == 'O')
+        state = cls(players, x, o, MARKS.index(turn_mark) - 1)
+        state.check()
+        return state
+
+    def text(self):
+        x, o = self.x, self.o
+        return ''.join([" XO"[(x >> cell & 1) | (o >> cell & 1) << 1] for cell in CELLS])
+
+    # 0 for an empty cell, 1 for X, 2 for O
+    def cell(self, cell):
+        return (self.x >> cell & 1) | (self.o >> cell & 1) << 1
+
+    @property
+    def mark(self):
+        return MARKS[self.turn + 1]
+
+    @property
+    def current_player(self):
+        return self.players[self.turn]
+
+    @property
+    def game_over(self):
+        return self.status is not Status.PLAYING
+
+    @property
+    def result(self):
+        if self.status is Status.WON:
+            return f"{self.players[self.seat]} ({MARKS[self.seat + 1]}) wins!"
+        if self.status is Status.DRAW:
+            return "It's a draw!"
+        if self.status is Status.ABANDONED:
+            return f"⚠️ {self.players[self.seat]} left the game."
+        return ""
+
+    # The current player takes `cell`, which the caller has checked is free
+    def play(self, cell):
+        if self.turn:
+            self.o = held = self.o | BITS[cell]
+        else:
+            self.x = held = self.x | BITS[cell]
+        for mask in MASKS_THROUGH[cell]:
+            if held & mask == mask:
+                self.status = Status.WON
+                self.seat = self.turn
+                return
+        if (self.x | self.o).bit_count() == 9:
+            self.status = Status.DRAW
+            return
+        self.turn ^= 1
+
+    # The whole board, for a game that didn't get here through play()
+    def check(self):
+        for seat, held in enumerate((self.x, self.o)):
+            for mask in WIN_MASKS:
+                if held & mask == mask:
+                    self.status = Status.WON
+                    self.seat = seat
+                    return
+        if (self.x | self.o).bit_count() == 9:
+            self.status = Status.DRAW
+
+    def abandon(self, seat):
+        self.status = Status.ABANDONED
+        self.seat = seat
+
+    def __getitem__(self, key):
+        if key == "board":
+            return [MARKS[self.cell(cell)] for cell in CELLS]
+        if key == "current_turn":
+            return self.mark
+        if key == "game_over":
+            return self.game_over
+        if key == "result":
+            return self.result
+        if key == "symbols":
+            return {self.players[0]: 'X', self.players[1]: 'O'}
+        if key == "players":
+            return list(self.players)
+        if key == "current_player":
+            return self.current_player
+        raise KeyError(key)
+
+    def __iter__(self):
+        return iter(KEYS)
+
+    def __len__(self):
+        return len(KEYS)
@@ -0,0 +1,103 @@
+import queue
+import threading
+
+# In-process pub/sub: publish() hands one already-serialized message to every
+# subscriber of a topic. Each subscriber has a bounded queue; one that stops
+# draining is evicted instead of letting its queue grow without limit.
+
+
+class Subscriber:
+    def __init__(self, topic, queue_size):
+        self.topic = topic
+        self.queue = queue.Queue(queue_size)
+        self.evicted = False
+
+    # Next message, or None if nothing arrived within `timeout`
+    def get(self, timeout=None):
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class Hub:
+    def __init__(self, queue_size=32):
+        self.queue_size = queue_size
+        self.lock = threading.Lock()
+        self.topics = {}
+        self.published = 0
+        self.delivered = 0
+        self.evicted = 0
+        self.listeners = []
+
+    # `callback(topic, message)` runs on every publish, in the publishing
+    # thread; used to bridge messages into an event loop
+    def add_listener(self, callback):
+        self.listeners.append(callback)
+
+    def subscribe(self, topic):
+        subscriber = Subscriber(topic, self.queue_size)
+        with self.lock:
+            self.topics.setdefault(topic, set()).add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self.lock:
+            subscribers = self.topics.get(subscriber.topic)
+            if subscribers is not None:
+                subscribers.discard(subscriber)
+                if not subscribers:
+                    del self.topics[subscriber.topic]
+
+    def publish(self, topic, message):
+        with self.lock:
+            subscribers = list(self.topics.get(topic, ()))
+            self.published += 1
+        delivered = 0
+        for subscriber in subscribers:
+            try:
+                subscriber.queue.put_nowait(message)
+                delivered += 1
+            except queue.Full:
+                self.evict(subscriber)
+        with self.lock:
+            self.delivered += delivered
+        for listener in self.listeners:
+            listener(topic, message)
+        return delivered
+
+    # The consumer notices `evicted` on its next loop and closes its
+    # connection; the client reconnects and catches up from a snapshot
+    def evict(self, subscriber):
+        subscriber.evicted = True
+        self.unsubscribe(subscriber)
+        with self.lock:
+            self.evicted += 1
+
+    # Evict every subscriber and wake the ones blocked in get(), e.g. so
+    # streams end when the server shuts down
+    def close(self):
+        with self.lock:
+            subscribers = [s for topic in self.topics.values() for s in topic]
+        for subscriber in subscribers:
+            self.evict(subscriber)
+            try:
+                subscriber.queue.put_nowait(None)
+            except queue.Full:
+                pass
+
+    def stats(self):
+        with self.lock:
+            subscribers = [s for topic in self.topics.values() for s in topic]
+            stats = {
+                "topics": len(self.topics),
+                "subscribers": len(subscribers),
+                "published": self.published,
+                "delivered": self.delivered,
+                "evicted": self.evicted,
+            }
+        depths = [s.queue.qsize() for s in subscribers]
+        stats["queue_depth_total"] = sum(depths)
+        stats["queue_depth_max"] = max(depths, default=0)
+        stats["queue_size"] = self.queue_size
+        return stats
@@ -0,0 +1,239 @@
+import fcntl
+import gzip
+import hashlib
+import json
+import os
+import pickle
+import re
+import threading
+import time
+
+from werkzeug.wsgi import ClosingIterator
+
+# WSGI wrappers that serve.py puts around a variant's app, so any variant can
+# be served with the same compression, caching and metrics without touching
+# its code.
+#
+# Compress and ConditionalGet have to see a whole body, so they only handle
+# finished pages and JSON: event streams, WebSocket upgrades and everything
+# else pass through untouched, and keep streaming.
+
+COMPRESSIBLE = ('text/html', 'text/plain', 'text/css', 'text/javascript', 'application/javascript',
+                'application/json')
+
+NUMBERS = re.compile(r'/\d+(?=/|$)')
+
+
+def header(headers, name):
+    name = name.lower()
+    for key, value in headers:
+        if key.lower() == name:
+            return value
+    return None
+
+def without(headers, *names):
+    names = {name.lower() for name in names}
+    return [(key, value) for key, value in headers if key.lower() not in names]
+
+def is_whole_page(status, headers):
+    content_type = (header(headers, 'Content-Type') or '').split(';')[0].strip()
+    return status.startswith('200') and content_type in COMPRESSIBLE
+
+# Runs the app, holding back its start_response until the caller has seen
+# the status and headers
+def call(app, environ):
+    response = []
+    def start_response(status, headers, exc_info=None):
+        response[:] = [status, headers]
+        return lambda data: None
+    body = app(environ, start_response)
+    return response[0], response[1], body
+
+def read(body):
+    try:
+        return b''.join(body)
+    finally:
+        if hasattr(body, 'close'):
+            body.close()
+
+
+# gzip for clients that take it. A compressed response gets a weak ETag,
+# since its bytes differ from the uncompressed one's; If-None-Match compares
+# weakly anyway, so the W/ is taken off again before the app sees it
+class Compress:
+    def __init__(self, app, min_size=512, level=6):
+        self.app = app
+        self.min_size = min_size
+        self.level = level
+
+    def __call__(self, environ, start_response):
+        if environ.get('HTTP_UPGRADE') or 'gzip' not in environ.get('HTTP_ACCEPT_ENCODING', ''):
+            return self.app(environ, start_response)
+        if 'HTTP_IF_NONE_MATCH' in environ:
+            environ['HTTP_IF_NONE_MATCH'] = environ['HTTP_IF_NONE_MATCH'].replace('W/', '')
+
+        status, headers, body = call(self.app, environ)
+        if status.startswith('304'):
+            start_response(status, self.weaken(headers))
+            return body
+        if not is_whole_page(status, headers) or header(headers, 'Content-Encoding'):
+            start_response(status, headers)
+            return body
+        data = read(body)
+        if len(data) < self.min_size:
+            start_response(status, headers)
+            return [data]
+
+        data = gzip.compress(data, self.level)
+        vary = header(headers, 'Vary')
+        headers = without(self.weaken(headers), 'Content-Length', 'Vary')
+        headers += [('Content-Encoding', 'gzip'), ('Content-Length', str(len(data))),
+                    ('Vary', f"{vary}, Accept-Encoding" if vary else 'Accept-Encoding')]
+        start_response(status, headers)
+        return [data]
+
+    def weaken(self, headers):
+        etag = header(headers, 'ETag')
+        if etag is None or etag.startswith('W/'):
+            return headers
+        return without(headers, 'ETag') + [('ETag', f"W/{etag}")]
+
+
+# ETags for pages the variant doesn't tag itself, taken from the body, so a
+# client that already has the page gets a 304 instead of it again. The page
+# is still rendered: this saves the bytes on the wire, not the work
+class ConditionalGet:
+    def __init__(self, app):
+        self.app = app
+
+    def __call__(self, environ, start_response):
+        if environ['REQUEST_METHOD'] != 'GET' or environ.get('HTTP_UPGRADE'):
+            return self.app(environ, start_response)
+
+        status, headers, body = call(self.app, environ)
+        if not is_whole_page(status, headers) or header(headers, 'ETag'):
+            start_response(status, headers)
+            return body
+        data = read(body)
+        etag = '"' + hashlib.blake2b(data, digest_size=12).hexdigest() + '"'
+        headers = headers + [('ETag', etag)]
+        if etag in [tag.strip() for tag in environ.get('HTTP_IF_NONE_MATCH', '').replace('W/', '').split(',')]:
+            start_response('304 Not Modified', without(headers, 'Content-Length', 'Content-Type'))
+            return []
+        start_response(status, headers)
+        return [data]
+
+
+# Request counts and latency per route, served as JSON at `path`. Numbers in
+# the path (room codes, cells) are folded together so a route is one entry
+# however many rooms there are. Latency runs until the body has been sent,
+# so for event streams it is how long they stayed open.
+#
+# Each worker process counts its own requests
+class RequestMetrics:
+    def __init__(self, app, path='/_serve/metrics'):
+        self.app = app
+        self.path = path
+        self.lock = threading.Lock()
+        self.routes = {}
+        self.in_flight = 0
+        self.started = time.time()
+
+    def __call__(self, environ, start_response):
+        if environ['PATH_INFO'] == self.path:
+            body = json.dumps(self.stats()).encode()
+            start_response('200 OK', [('Content-Type', 'application/json'), ('Content-Length', str(len(body))),
+                                      ('Cache-Control', 'no-store')])
+            return [body]
+
+        route = f"{environ['REQUEST_METHOD']} {NUMBERS.sub('/<n>', environ['PATH_INFO'])}"
+        started = time.perf_counter()
+        statuses = []
+        def counted_start_response(status, headers, exc_info=None):
+            statuses.append(status)
+            return start_response(status, headers, exc_info)
+        def record():
+            self.record(route, statuses[-1][:3] if statuses else '500', time.perf_counter() - started)
+
+        with self.lock:
+            self.in_flight += 1
+        try:
+            return ClosingIterator(self.app(environ, counted_start_response), record)
+        except BaseException:
+            record()
+            raise
+
+    def record(self, route, status, seconds):
+        with self.lock:
+            self.in_flight -= 1
+            entry = self.routes.get(route)
+            if entry is None:
+                entry = self.routes[route] = {"count": 0, "errors": 0, "total": 0.0, "max": 0.0, "statuses": {}}
+            entry["count"] += 1
+            entry["errors"] += status.startswith('5')
+            entry["total"] += seconds
+            entry["max"] = max(entry["max"], seconds)
+            entry["statuses"][status] = entry["statuses"].get(status, 0) + 1
+
+    def stats(self):
+        with self.lock:
+            return {
+                "uptime": round(time.time() - self.started, 1),
+                "in_flight": self.in_flight,
+                "routes": {route: {"count": entry["count"], "errors": entry["errors"],
+                                   "mean_ms": round(entry["total"] / entry["count"] * 1000, 2),
+                                   "max_ms": round(entry["max"] * 1000, 2), "statuses": entry["statuses"]}
+                           for route, entry in sorted(self.routes.items())},
+            }
+
+
+# One rooms dict for every worker process, for variants whose rooms are a
+# plain dict that only changes while a request is handled (v2, v6-v11). The
+# dict lives pickled at `path`: each request takes a file lock shared by the
+# workers (and a lock shared by this worker's threads), loads the dict if
+# another worker changed it, runs, and writes it back if it changed itself.
+#
+# Requests therefore run one at a time across the whole server, which is
+# what the variant's own code assumes of its dict. Bodies are read inside the
+# lock, so this is only for variants that don't stream
+class SharedRooms:
+    def __init__(self, app, rooms, path):
+        self.app = app
+        self.rooms = rooms
+        self.path = path
+        self.lock = threading.Lock()
+        # The pickle the dict was last loaded from or saved as
+        self.data = None
+
+    @staticmethod
+    def create(rooms, path):
+        with open(path + '.tmp', 'wb') as f:
+            pickle.dump(rooms, f)
+        os.replace(path + '.tmp', path)
+
+    def __call__(self, environ, start_response):
+        with self.lock, open(self.path + '.lock', 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            self.load()
+            status, headers, body = call(self.app, environ)
+            data = read(body)
+            self.save()
+        start_response(status, headers)
+        return [data]
+
+    def load(self):
+        with open(self.path, 'rb') as f:
+            data = f.read()
+        if data != self.data:
+            self.rooms.clear()
+            self.rooms.update(pickle.loads(data))
+            self.data = data
+
+    def save(self):
+        data = pickle.dumps(self.rooms)
+        if data == self.data:
+            return
+        with open(self.path + '.tmp', 'wb') as f:
+            f.write(data)
+        os.replace(self.path + '.tmp', self.path)
+        self.data = data
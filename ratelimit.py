@@ -0,0 +1,70 @@
+import math
+import threading
+import time
+
+# Token-bucket rate limits per client. Every budget has a refill rate (tokens
+# per second) and a burst (bucket size); each request spends one token from
+# each of its client's buckets (e.g. one per IP and one per session) and is
+# refused while any of them is empty.
+#
+# Buckets are stored as (tokens, last update) tuples in one dict. A bucket
+# that has refilled to its burst is the same as no bucket at all, so the
+# table is pruned of those every `prune_every` seconds and only holds the
+# clients that were busy recently.
+
+
+class RateLimiter:
+    def __init__(self, budgets, prune_every=60):
+        self.budgets = budgets
+        self.prune_every = prune_every
+        self.lock = threading.Lock()
+        self.buckets = {}
+        self.next_prune = time.monotonic() + prune_every
+        self.allowed = 0
+        self.refused = 0
+
+    # None if the request may go ahead, else the seconds until it would be
+    # allowed. `budget` names an entry of `budgets`; `keys` identify the client
+    def check(self, budget, keys):
+        rate, burst = self.budgets[budget]
+        now = time.monotonic()
+        with self.lock:
+            if now >= self.next_prune:
+                self.prune(now)
+            levels = []
+            for key in keys:
+                bucket = self.buckets.get((budget, key))
+                tokens = burst if bucket is None else min(burst, bucket[0] + (now - bucket[1]) * rate)
+                levels.append(tokens)
+            if min(levels) < 1:
+                self.refused += 1
+                return (1 - min(levels)) / rate
+            for key, tokens in zip(keys, levels):
+                self.buckets[(budget, key)] = (tokens - 1, now)
+            self.allowed += 1
+            return None
+
+    # Called with the lock held
+    def prune(self, now):
+        full = [name for name, (tokens, last) in self.buckets.items()
+                if tokens + (now - last) * self.budgets[name[0]][0] >= self.budgets[name[0]][1]]
+        for name in full:
+            del self.buckets[name]
+        self.next_prune = now + self.prune_every
+
+    def stats(self):
+        with self.lock:
+            return {"buckets": len(self.buckets), "allowed": self.allowed, "refused": self.refused}
+
+
+def retry_after_header(wait):
+    return str(max(1, math.ceil(wait)))
+
+
+# A 429 for a refused request, as a Flask (body, status, headers) tuple.
+# The page retries by itself once the client may go ahead
+def too_many_requests(wait):
+    retry_after = retry_after_header(wait)
+    page = (f'<!DOCTYPE html><meta http-equiv="refresh" content="{retry_after}">'
+            f'<p>Too many requests, trying again in {retry_after} seconds...</p>')
+    return page, 429, {"Retry-After": retry_after}
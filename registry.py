@@ -0,0 +1,83 @@
+import threading
+from contextlib import contextmanager
+
+# The rooms of a server, for many request threads at once. Each room is a
+# dict with its own "lock", and everything that changes a room (joining,
+# moving, restarting, leaving) runs inside locked(), so two requests for the
+# same room take turns while requests for different rooms never wait on
+# each other.
+#
+# The map itself is split into a power-of-two number of shards by the hash of
+# the room code, each with its own lock, which is only held to add or remove
+# a room; creating rooms in different shards doesn't serialize either.
+# Lookups take no lock at all: a shard is a plain dict, and reading one is a
+# single atomic step for Python.
+#
+# Lock order is room first, then shard: remove() may be called with a room
+# locked, and a shard lock is never held while waiting for a room. A room
+# found by a lookup may be closed a moment later, which is why changes go
+# through locked().
+
+
+class RoomRegistry:
+    def __init__(self, shards=16):
+        if shards < 1 or shards & (shards - 1):
+            raise ValueError(f"shards must be a power of two, got {shards}")
+        self.mask = shards - 1
+        self.locks = [threading.Lock() for _ in range(shards)]
+        self.shards = [{} for _ in range(shards)]
+
+    def shard_of(self, code):
+        return hash(code) & self.mask
+
+    def get(self, code, default=None):
+        return self.shards[hash(code) & self.mask].get(code, default)
+
+    def __getitem__(self, code):
+        return self.shards[hash(code) & self.mask][code]
+
+    def __contains__(self, code):
+        return code in self.shards[hash(code) & self.mask]
+
+    def __len__(self):
+        return sum(len(shard) for shard in self.shards)
+
+    def __iter__(self):
+        return iter([code for shard in self.shards for code in list(shard)])
+
+    def values(self):
+        return [room for shard in self.shards for room in list(shard.values())]
+
+    # A new room under a code nobody holds: `generate` draws candidate codes
+    # and `build(code)` makes the room
+    def create(self, generate, build):
+        while True:
+            code = generate()
+            index = self.shard_of(code)
+            with self.locks[index]:
+                if code not in self.shards[index]:
+                    room = self.shards[index][code] = build(code)
+                    return room
+
+    def add(self, room):
+        index = self.shard_of(room["code"])
+        with self.locks[index]:
+            self.shards[index][room["code"]] = room
+
+    # Only removes `room` itself, not a newer room that took over its code
+    def remove(self, room):
+        index = self.shard_of(room["code"])
+        with self.locks[index]:
+            if self.shards[index].get(room["code"]) is room:
+                del self.shards[index][room["code"]]
+
+    # The room with its lock held, or None if there is no such room (or it
+    # was closed while we waited for the lock)
+    @contextmanager
+    def locked(self, code):
+        room = self.get(code)
+        if room is None:
+            yield None
+            return
+        with room["lock"]:
+            yield room if self.get(code) is room else None
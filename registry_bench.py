@@ -0,0 +1,63 @@
+import argparse
+import os
+import random
+import threading
+import time
+
+from registry import RoomRegistry
+
+# Microbenchmark for RoomRegistry: lookups (get a room and read its
+# snapshot, as game() does) and mutations (create a room, then remove it)
+# from 1, 4, 16 and 64 threads, with the map split into --shards shards.
+# Compare --shards 1, i.e. one lock for the whole map, with the default.
+#
+#   python registry_bench.py --shards 1 16 --threads 1 4 16 64
+
+
+def new_room(code):
+    return {"code": code, "lock": threading.RLock(), "snapshot": {"v": 0}}
+
+def lookups(registry, codes, count):
+    for code in random.choices(codes, k=count):
+        registry.get(code)["snapshot"]
+
+def mutations(registry, codes, count):
+    generate = lambda: str(random.randrange(10 ** 9))
+    for _ in range(count):
+        registry.remove(registry.create(generate, new_room))
+
+# Operations per second with `threads` threads each doing `count` of them
+def measure(operation, registry, codes, threads, count):
+    start = threading.Barrier(threads + 1)
+    def work():
+        start.wait()
+        operation(registry, codes, count)
+    workers = [threading.Thread(target=work) for _ in range(threads)]
+    for worker in workers:
+        worker.start()
+    start.wait()
+    started = time.perf_counter()
+    for worker in workers:
+        worker.join()
+    return threads * count / (time.perf_counter() - started)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark RoomRegistry lookups and mutations across threads")
+    parser.add_argument('--shards', type=int, nargs='+', default=[1, 16])
+    parser.add_argument('--threads', type=int, nargs='+', default=[1, 4, 16, 64])
+    parser.add_argument('--rooms', type=int, default=10000, help="rooms in the map while measuring")
+    parser.add_argument('--operations', type=int, default=200000, help="operations per run, split across threads")
+    args = parser.parse_args()
+
+    print(f"{os.cpu_count()} cores, {args.rooms} rooms, {args.operations} operations per run")
+    for shards in args.shards:
+        registry = RoomRegistry(shards)
+        codes = [registry.create(lambda: str(random.randrange(10 ** 9)), new_room)["code"]
+                 for _ in range(args.rooms)]
+        print(f"{shards} shard(s):")
+        for threads in args.threads:
+            count = args.operations // threads
+            found = measure(lookups, registry, codes, threads, count)
+            changed = measure(mutations, registry, codes, threads, count)
+            print(f"  {threads:>3} threads: {found:>10.0f} lookups/s  {changed:>9.0f} create+remove/s")
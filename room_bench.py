@@ -0,0 +1,88 @@
+import argparse
+import os
+import random
+import threading
+import time
+
+import v12
+
+# Contention benchmark for v12's room locks: each thread plays random games
+# in its own room through play_move()/restart_room(), the calls the request
+# handlers make, for a fixed time. With --global-lock every room shares one
+# lock instead, which is what a single registry-wide lock would amount to.
+#
+# --hold-ms keeps each move's lock held for a while longer, as a slow
+# subscriber or disk write inside the lock would. Python runs one thread at
+# a time, so pure move logic can't get faster with threads; it is the time
+# spent waiting inside a lock that per-room locks let other rooms use.
+#
+#   python room_bench.py --threads 1 2 4 8 16 --hold-ms 1
+#   python room_bench.py --threads 1 2 4 8 16 --hold-ms 1 --global-lock
+
+
+def play(room_code, players, deadline, counts, index):
+    moves = 0
+    while time.perf_counter() < deadline:
+        room = v12.rooms[room_code]
+        game_state = room["state"]
+        if game_state.game_over:
+            v12.restart_room(room_code)
+            continue
+        cell = random.choice([i for i in range(9) if not game_state.cell(i)])
+        if v12.play_move(room_code, game_state.current_player, cell) is None:
+            moves += 1
+    counts[index] = moves
+
+
+def run(threads, args):
+    codes = []
+    for index in range(threads):
+        players = [f"bench-{index}-x", f"bench-{index}-o"]
+        room_code = v12.create_room(players[0])
+        v12.join_room(room_code, players[1])
+        codes.append((room_code, players))
+    if args.global_lock:
+        shared = threading.RLock()
+        for room_code, players in codes:
+            v12.rooms[room_code]["lock"] = shared
+            v12.rooms[room_code]["changed"] = threading.Condition(shared)
+
+    counts = [0] * threads
+    deadline = time.perf_counter() + args.seconds
+    workers = [threading.Thread(target=play, args=(room_code, players, deadline, counts, index))
+               for index, (room_code, players) in enumerate(codes)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    for room_code, players in codes:
+        for player in players:
+            v12.leave_room(room_code, player)
+    return sum(counts) / args.seconds
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark move throughput as threads (one room each) are added")
+    parser.add_argument('--threads', type=int, nargs='+', default=[1, 2, 4, 8, 16])
+    parser.add_argument('--seconds', type=float, default=3)
+    parser.add_argument('--hold-ms', type=float, default=0,
+                        help="extra milliseconds each move holds its room's lock, waiting as on I/O")
+    parser.add_argument('--global-lock', action='store_true',
+                        help="make every room share one lock, for comparison")
+    args = parser.parse_args()
+
+    if args.hold_ms:
+        publish = v12.hub.publish
+        def slow_publish(topic, message):
+            time.sleep(args.hold_ms / 1000)
+            publish(topic, message)
+        v12.hub.publish = slow_publish
+
+    locking = "one lock for all rooms" if args.global_lock else "a lock per room"
+    print(f"{os.cpu_count()} cores, {locking}, {args.hold_ms:g} ms held per move, {args.seconds:g}s per run")
+    baseline = None
+    for threads in args.threads:
+        rate = run(threads, args)
+        baseline = baseline or rate
+        print(f"{threads:>3} threads: {rate:>8.0f} moves/s  ({rate / baseline:.2f}x)")
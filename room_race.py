@@ -0,0 +1,81 @@
+import argparse
+import sys
+import threading
+import time
+
+import gamestate
+import v12
+
+# Race check for v12's room locks: for each trial, three guests try to join
+# one host's room at once, then both seated players send moves from two
+# threads each, every cell in turn. With each room's changes under its lock
+# the room ends up with exactly two players and a board that could have
+# been played; without it joins overfill rooms and moves overwrite each
+# other. Exits non-zero if any trial went wrong.
+#
+# --hold-ms makes every move take a while inside the lock, and threads are
+# switched as often as Python allows, so races that need bad timing get it.
+#
+#   python room_race.py --trials 300
+
+
+# No cell taken twice, and X never more than one move ahead of O
+def check_board(state):
+    if state is None:
+        return True
+    x_moves, o_moves = state.x.bit_count(), state.o.bit_count()
+    return not state.x & state.o and o_moves <= x_moves <= o_moves + 1
+
+def trial(index):
+    room_code = v12.create_room(f"host-{index}")
+    start = threading.Barrier(3)
+    def join(guest):
+        start.wait()
+        v12.join_room(room_code, f"guest-{index}-{guest}")
+    run_all([threading.Thread(target=join, args=(guest,)) for guest in range(3)])
+
+    room = v12.rooms[room_code]
+    players = list(room["players"])
+    start = threading.Barrier(4)
+    def move(player):
+        start.wait()
+        for cell in range(9):
+            v12.play_move(room_code, player, cell)
+            v12.play_move(room_code, player, 8 - cell)
+    run_all([threading.Thread(target=move, args=(player,)) for player in players[:2] * 2])
+
+    valid = check_board(room["state"])
+    for player in players:
+        v12.leave_room(room_code, player)
+    return len(players) == 2, valid
+
+def run_all(threads):
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check that concurrent joins and moves can't corrupt a room")
+    parser.add_argument('--trials', type=int, default=300)
+    parser.add_argument('--hold-ms', type=float, default=0.5,
+                        help="milliseconds each move spends inside the room's lock")
+    args = parser.parse_args()
+
+    sys.setswitchinterval(1e-6)
+    if args.hold_ms:
+        play = gamestate.GameState.play
+        def slow_play(state, cell):
+            time.sleep(args.hold_ms / 1000)
+            play(state, cell)
+        gamestate.GameState.play = slow_play
+
+    overfull = corrupt = 0
+    for index in range(args.trials):
+        seated, valid = trial(index)
+        overfull += not seated
+        corrupt += not valid
+    print(f"{args.trials} trials: {overfull} rooms with the wrong number of players, {corrupt} corrupt boards")
+    if overfull or corrupt:
+        raise SystemExit("concurrent changes to a room interfered with each other")
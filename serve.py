@@ -0,0 +1,191 @@
+import argparse
+import importlib.util
+import os
+import shutil
+import signal
+import socket
+import sys
+import tempfile
+
+from gunicorn.app.base import BaseApplication
+
+from middleware import Compress, ConditionalGet, RequestMetrics, SharedRooms
+from registry import RoomRegistry
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# Production runner: serves a variant's Flask `app` under gunicorn's pre-fork
+# server with a pool of threads per worker, instead of Flask's development
+# server.
+#
+#   python serve.py v12.py --threads 256
+#   python serve.py v4.py --workers 4
+#   python serve.py v8.py --workers 4 --shared-rooms
+#   python serve.py v7.py --compress --etags --metrics
+#
+# Any variant can be served this way, with the same serving options, so they
+# can be compared under identical conditions: --compress, --etags and
+# --metrics wrap its app in the WSGI middleware from middleware.py.
+#
+# Session-only variants (v1, v3, v4, v5) keep their game in the cookie and
+# can fork as many workers as there are cores. Variants with a plain `rooms`
+# dict (v2, v6-v11) only touch it while handling a request, so with
+# --shared-rooms every worker works on one copy of it kept in a file (see
+# SharedRooms in middleware.py). v12's rooms come with room conditions, pub/sub
+# streams and presence timers tied to the connections its process holds,
+# which no other process could wake or time out: it runs as a single worker
+# and scales with --threads.
+
+
+def get_ip():
+    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        s.connect(("10.255.255.255", 1))
+        IP = s.getsockname()[0]
+    except Exception:
+        IP = "127.0.0.1"
+    finally:
+        s.close()
+    return IP
+
+
+def load_variant(path):
+    path = os.path.abspath(path)
+    name = os.path.splitext(os.path.basename(path))[0].replace(' ', '_')
+    sys.path.insert(0, os.path.dirname(path))
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def has_plain_rooms(module):
+    return type(getattr(module, 'rooms', None)) is dict
+
+def has_process_bound_rooms(module):
+    return isinstance(getattr(module, 'rooms', None), RoomRegistry)
+
+# A temporary file the workers share the rooms through, removed on exit
+def share_rooms(module, options):
+    store = tempfile.mkdtemp(prefix='serve-rooms-')
+    path = os.path.join(store, 'rooms.pickle')
+    SharedRooms.create(module.rooms, path)
+    options['on_exit'] = lambda server: shutil.rmtree(store, ignore_errors=True)
+    return SharedRooms(module.app, module.rooms, path)
+
+
+# Variants that snapshot their rooms (v12) restore them before the worker
+# forks, and save them once the worker has finished its requests. SIGTERM
+# drains first, so open streams close instead of holding the worker until
+# gunicorn's graceful timeout runs out and it is killed unsaved
+def snapshot_hooks(module):
+    if not hasattr(module, 'save_rooms'):
+        return {}
+    restored = module.load_rooms(module.read_snapshot())
+    if restored:
+        print(f"Restored {restored} rooms from {module.SNAPSHOT_PATH}")
+
+    def post_worker_init(worker):
+        def handle_exit(signum, frame):
+            module.drain()
+            worker.handle_exit(signum, frame)
+        signal.signal(signal.SIGTERM, handle_exit)
+
+    def worker_exit(server, worker):
+        print(f"Saved {module.save_rooms()} rooms to {module.SNAPSHOT_PATH}")
+
+    return {'post_worker_init': post_worker_init, 'worker_exit': worker_exit}
+
+
+class Server(BaseApplication):
+    def __init__(self, app, options):
+        self.application = app
+        self.options = options
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+
+    def load(self):
+        return self.application
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Serve a tic-tac-toe variant under gunicorn")
+    parser.add_argument('variant', nargs='?', default=os.path.join(HERE, 'v12.py'),
+                        help="path to the variant to serve (default: v12.py)")
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--workers', type=int, default=1,
+                        help="worker processes; variants with a rooms dict need --shared-rooms for more than one")
+    parser.add_argument('--threads', type=int, default=64,
+                        help="threads per worker; every open SSE/WebSocket/long-poll holds one")
+    parser.add_argument('--keepalive', type=int, default=5,
+                        help="seconds an idle keep-alive connection is held open")
+    parser.add_argument('--backlog', type=int, default=2048,
+                        help="listen backlog for connections waiting to be accepted")
+    parser.add_argument('--max-connections', type=int, default=1000,
+                        help="simultaneous client connections per worker")
+    parser.add_argument('--graceful-timeout', type=int, default=30,
+                        help="seconds in-flight requests get to finish on shutdown")
+    parser.add_argument('--shared-rooms', action='store_true',
+                        help="keep a plain rooms dict in one store every worker uses (v2, v6-v11); "
+                             "requests then run one at a time across workers")
+    parser.add_argument('--compress', action='store_true',
+                        help="gzip pages and JSON for clients that accept it")
+    parser.add_argument('--etags', action='store_true',
+                        help="tag pages the variant doesn't tag itself and answer repeats with 304")
+    parser.add_argument('--metrics', nargs='?', const='/_serve/metrics', default=None, metavar='PATH',
+                        help="count requests and latency per route, served as JSON at PATH "
+                             "(default /_serve/metrics); each worker counts its own")
+    return parser
+
+
+def wrap(app, args):
+    if args.etags:
+        app = ConditionalGet(app)
+    if args.compress:
+        app = Compress(app)
+    if args.metrics:
+        app = RequestMetrics(app, args.metrics)
+    return app
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    module = load_variant(args.variant)
+    name = os.path.basename(args.variant)
+    if (args.workers > 1 or args.shared_rooms) and has_process_bound_rooms(module):
+        raise SystemExit(f"{name} ties its rooms to the connections of one process, so every player of a "
+                         f"room has to reach the same process: run it with --workers 1 and raise "
+                         f"--threads instead")
+    if args.shared_rooms and not has_plain_rooms(module):
+        raise SystemExit(f"{name} has no rooms dict to share")
+    if args.workers > 1 and has_plain_rooms(module) and not args.shared_rooms:
+        raise SystemExit(f"{name} keeps its rooms in process memory, so each worker would see different "
+                         f"rooms: add --shared-rooms, or run it with --workers 1")
+
+    options = {
+        'bind': f"{args.host}:{args.port}",
+        'workers': args.workers,
+        'worker_class': 'gthread',
+        'threads': args.threads,
+        'worker_connections': args.max_connections,
+        'keepalive': args.keepalive,
+        'backlog': args.backlog,
+        'graceful_timeout': args.graceful_timeout,
+        # Long-polls and event streams legitimately stay open; the timeout
+        # only has to catch a worker that stopped heartbeating to the arbiter
+        'timeout': 120,
+    }
+    options.update(snapshot_hooks(module))
+    app = share_rooms(module, options) if args.shared_rooms else module.app
+    print(f"🚀 Serving {os.path.basename(args.variant)} with {args.workers} worker(s) x {args.threads} threads. "
+          f"Access from phone: http://{get_ip()}:{args.port}")
+    Server(wrap(app, args), options).run()
+
+
+if __name__ == "__main__":
+    main()
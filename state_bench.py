@@ -0,0 +1,79 @@
+import argparse
+import random
+import tracemalloc
+
+import v12
+from gamestate import GameState
+
+# Memory per room of a game's state: the GameState object v12 keeps now
+# against the dict initialize_game() used to return, for --rooms rooms each
+# --moves moves into a game. Then the same for whole rooms (lock, condition,
+# delta history, snapshot) holding either kind of state, to show how much of
+# a room the state is.
+#
+#   python state_bench.py --rooms 100000
+
+
+# The dict initialize_game() used to return; win_bench.py plays on it too
+def dict_state(players):
+    return {
+        "board": ['' for _ in range(9)],
+        "current_turn": 'X',
+        "game_over": False,
+        "result": "",
+        "symbols": {players[0]: 'X', players[1]: 'O'},
+        "players": players,
+        "current_player": players[0]
+    }
+
+def dict_move(state, cell):
+    state["board"][cell] = state["current_turn"]
+    state["current_turn"] = 'O' if state["current_turn"] == 'X' else 'X'
+    state["current_player"] = [p for p in state["players"] if p != state["current_player"]][0]
+
+def state_move(state, cell):
+    state.play(cell)
+
+# Bytes allocated per item by `build(players, cells)`, counting neither the
+# nicknames nor the move lists, which both layouts share
+def measure(build, games):
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    kept = [build(players, cells) for players, cells in games]
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del kept
+    return used / len(games)
+
+def play(new, move):
+    def build(players, cells):
+        state = new(players)
+        for cell in cells:
+            move(state, cell)
+        return state
+    return build
+
+def in_room(build):
+    def room(players, cells):
+        room = v12.new_room("0000", players)
+        room["state"] = build(players, cells)
+        return room
+    return room
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the memory of GameState with the old dict game state")
+    parser.add_argument('--rooms', type=int, default=100000)
+    parser.add_argument('--moves', type=int, default=4, help="moves played in each game, 0-4 so none is over")
+    args = parser.parse_args()
+
+    # Nicknames and move lists are made up front, so only the states count
+    games = [([f"player-{index}-x", f"player-{index}-o"], random.sample(range(9), args.moves))
+             for index in range(args.rooms)]
+    layouts = [("dict", play(dict_state, dict_move)), ("GameState", play(GameState, state_move))]
+
+    print(f"{args.rooms} rooms, {args.moves} moves into each game")
+    for label, build in layouts:
+        state = measure(build, games)
+        room = measure(in_room(build), games)
+        print(f"  {label:>9}: {state:>6.0f} bytes per state  {room:>6.0f} bytes per room")
@@ -0,0 +1,82 @@
+import math
+import os
+import threading
+import time
+import traceback
+
+# Hashed timing wheel: a ring of slots, one per tick. Scheduling, rescheduling
+# and cancelling a key is O(1), and each tick only looks at the one slot that
+# just came due, so tracking many thousands of deadlines costs the same per
+# tick as tracking a handful. Delays longer than one turn of the wheel stay in
+# their slot until their deadline tick comes round.
+
+
+class TimingWheel:
+    def __init__(self, tick=1.0, slots=64):
+        self.tick = tick
+        self.slots = [{} for _ in range(slots)]
+        self.where = {}
+        self.now = 0
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.where)
+
+    def __contains__(self, key):
+        return key in self.where
+
+    # (Re)arm `key` to expire `delay` seconds from now
+    def schedule(self, key, delay):
+        ticks = max(1, math.ceil(delay / self.tick))
+        with self.lock:
+            deadline = self.now + ticks
+            index = deadline % len(self.slots)
+            old = self.where.get(key)
+            if old is not None and old != index:
+                del self.slots[old][key]
+            self.slots[index][key] = deadline
+            self.where[key] = index
+
+    def cancel(self, key):
+        with self.lock:
+            index = self.where.pop(key, None)
+            if index is not None:
+                del self.slots[index][key]
+
+    # Move the wheel one tick and return the keys that expired on it
+    def advance(self):
+        with self.lock:
+            self.now += 1
+            slot = self.slots[self.now % len(self.slots)]
+            expired = [key for key, deadline in slot.items() if deadline <= self.now]
+            for key in expired:
+                del slot[key]
+                del self.where[key]
+        return expired
+
+    # Tick in a daemon thread, calling `on_expire(key)` for every expired key.
+    # Ticks missed while the process was busy are caught up, not skipped. A
+    # forked child (e.g. a pre-fork server worker) gets its own ticker, since
+    # threads do not survive fork()
+    def start(self, on_expire):
+        def run():
+            next_tick = time.monotonic() + self.tick
+            while True:
+                time.sleep(max(0, next_tick - time.monotonic()))
+                while next_tick <= time.monotonic():
+                    next_tick += self.tick
+                    for key in self.advance():
+                        try:
+                            on_expire(key)
+                        except Exception:
+                            traceback.print_exc()
+
+        def spawn():
+            threading.Thread(target=run, daemon=True).start()
+
+        def respawn():
+            self.lock = threading.Lock()
+            spawn()
+
+        os.register_at_fork(after_in_child=respawn)
+        spawn()
@@ -2,8 +2,10 @@ import time
 import threading
 import socket
 import random
+import secrets
 from datetime import datetime
 from flask import Flask, render_template_string, request, redirect, url_for, session
+from ratelimit import RateLimiter, too_many_requests
 
 # Initialize Flask app
 app = Flask(__name__)
@@ -69,10 +71,29 @@ def check_win(game_state):
         game_state["game_over"] = True
         game_state["result"] = "It's a draw!"
 
-# Before each request
+# Requests per second and burst each phone gets, by kind of request, so one
+# stuck tab can't take the server time of every other player
+limits = RateLimiter({
+    "poll": (2, 10),
+    "move": (4, 8),
+    "create": (0.2, 3),
+})
+endpoint_budgets = {'move': 'move', 'restart': 'move'}
+
+def request_budget():
+    if request.endpoint == 'index' and request.method == 'POST':
+        return 'create'
+    return endpoint_budgets.get(request.endpoint, 'poll')
+
+# Before each request: rate limit by device and by session, then log
 @app.before_request
 def log_access():
     ip = request.remote_addr
+    if 'client' not in session:
+        session['client'] = secrets.token_hex(8)
+    wait = limits.check(request_budget(), (('ip', ip), ('session', session['client'])))
+    if wait is not None:
+        return too_many_requests(wait)
     log_event(f"🌐 Access from {ip} to {request.path}")
 
 # Home page: get nickname
@@ -235,5 +256,7 @@ def run_flask():
     print(f"🚀 Flask app running! Access from phone: http://{ip}:5000")
     app.run(host="0.0.0.0", port=5000)
 
-# Start Flask server in a thread
-threading.Thread(target=run_flask).start()
+# Serve from the main thread: a non-daemon server thread outlived the main
+# one, so Ctrl+C and SIGTERM could not stop the process
+if __name__ == "__main__":
+    run_flask()
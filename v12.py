@@ -1,126 +1,632 @@
+import time
+boot_started = time.perf_counter()
+
+import argparse
+import glob
+import hashlib
+import json
+import math
+import os
 import random
-from flask import Flask, render_template_string, request, redirect, url_for, session
+import signal
+import socket
+import subprocess
+import sys
+import threading
+from collections import deque
+from admission import AdmissionLimiter, CRITICAL, NORMAL, LOW
+from codes import CodeAllocator
+from coalesce import Coalescer
+from gamestate import GameState
+from hub import Hub
+from registry import RoomRegistry
+from timing_wheel import TimingWheel
+imports_done = time.perf_counter()
+from flask import Flask, Response, g, jsonify, make_response, render_template, request, redirect, url_for, session
+from jinja2 import DictLoader
+from werkzeug.serving import make_server
+flask_done = time.perf_counter()
+
+try:
+    from flask_sock import Sock
+    from simple_websocket import ConnectionClosed
+    from wsproto.utilities import LocalProtocolError
+except ImportError:
+    Sock = None
+
+# (phase, started, finished) for each step of startup, on the
+# time.perf_counter() clock; printed by --profile-startup
+startup_phases = [("import stdlib and local modules", boot_started, imports_done),
+                  ("import flask", imports_done, flask_done),
+                  ("import flask_sock", flask_done, time.perf_counter())]
+profile_startup = False
+# Seconds from start to listening that `--profile-startup` checks against
+STARTUP_BUDGET = 0.3
 
 app = Flask(__name__)
 app.secret_key = 'your_secret_key'
 
 # Global game rooms for multiplayer
-rooms = {}
+rooms = RoomRegistry()
+
+# Fans serialized room updates out to every open SSE/WebSocket stream
+hub = Hub()
+
+# Identical renders of the same room version for the same viewer are done
+# once, however many requests ask for them at the same moment
+renders = Coalescer(ttl=2.0)
+
+# Under overload requests are turned away with a 503 rather than left to
+# queue; see admission.py
+admission = AdmissionLimiter()
+
+# Moves, joins and leaving are shed last, then the views players refresh,
+# then pages anyone can reload
+endpoint_priority = {
+    'move': CRITICAL,
+    'api_move': CRITICAL,
+    'restart': CRITICAL,
+    'api_restart': CRITICAL,
+    'exit_game': CRITICAL,
+    'room_heartbeat': CRITICAL,
+    'game': NORMAL,
+    'wait_for_player': NORMAL,
+}
+# Held open on purpose, so how long they take says nothing about load
+unlimited_endpoints = {'room_events', 'room_state', 'room_socket'}
+
+# A seated player counts as present while they keep making requests or hold
+# an open stream. Streams heartbeat every HEARTBEAT_INTERVAL seconds; a seat
+# silent for HEARTBEAT_TIMEOUT (or RECONNECT_GRACE after its stream closed)
+# abandons the room
+HEARTBEAT_INTERVAL = 10
+HEARTBEAT_TIMEOUT = 30
+RECONNECT_GRACE = 5
+presence = TimingWheel(tick=1.0, slots=64)
+
+# Rooms are closed after this many seconds without a change (a join, move,
+# restart or departure), by phase: waiting for a second player, in play, or
+# over. Presence already closes rooms whose players are gone; this catches
+# the ones kept alive by a tab left open
+ROOM_TTL = {"waiting": 15 * 60, "active": 30 * 60, "finished": 10 * 60}
+idle_rooms = TimingWheel(tick=5.0, slots=64)
+# Rooms closed for being idle, by the phase they were in
+reaped = {"waiting": 0, "active": 0, "finished": 0}
+
+# Room versions restart at 0 with the process, so ETags carry a boot id too
+boot_id = random.getrandbits(32)
+
+# Live rooms are written here on shutdown and restored on the next start.
+# Processes of a cluster each write their own part next to it
+SNAPSHOT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'rooms-snapshot.json')
+# Seconds in-flight requests get to finish once shutdown starts
+DRAIN_TIMEOUT = 10
+# Set when shutdown starts: no new rooms, and open streams and long-polls
+# are let go so their clients reconnect to the next process
+draining = threading.Event()
+# Set once a reload has handed the rooms to the new process; anything this
+# one still receives is sent over there
+handed_off = threading.Event()
+
+# Room codes are handed out without collisions and come back when the room
+# closes
+codes = CodeAllocator()
 
 def generate_code():
-    return str(random.randint(1000, 9999))
+    return codes.allocate()
+
+# How many versions of deltas a room keeps before late clients get a snapshot
+DELTA_HISTORY = 16
+
+# "lock" guards the room's players, state and version; "changed" is signalled
+# under it whenever the version moves on. "snapshot" is the room_snapshot()
+# of the current version, replaced (never modified) on every change, so page
+# views can read a consistent room without taking the lock
+def new_room(room_code, players):
+    lock = threading.RLock()
+    room = {"code": room_code, "players": players, "state": None, "version": 0, "lock": lock,
+            "changed": threading.Condition(lock), "changes": deque(maxlen=DELTA_HISTORY),
+            "active": time.monotonic()}
+    room["snapshot"] = room_snapshot(room)
+    return room
+
+def room_phase(room):
+    if not room["state"]:
+        return "waiting"
+    return "finished" if room["state"].game_over else "active"
+
+# Restart the room's idle countdown, for the TTL of the phase it is in now
+def touch(room):
+    room["active"] = time.monotonic()
+    idle_rooms.schedule(room["code"], ROOM_TTL[room_phase(room)])
+
+# Bump the room version, publish the change to the room's subscribers and
+# wake every long-poll waiting on it. `delta` is what changed; None means
+# clients have to take a fresh snapshot
+def notify_room(room, delta=None):
+    with room["changed"]:
+        room["version"] += 1
+        room["snapshot"] = room_snapshot(room)
+        if delta is not None:
+            delta["v"] = room["version"]
+            update = {"v": room["version"], "d": [delta]}
+        else:
+            update = room["snapshot"]
+        room["changes"].append((room["version"], delta))
+        closed = delta is not None and "x" in delta
+        if not closed:
+            touch(room)
+        hub.publish(room["code"], (room["version"], encode_update(update), closed))
+        room["changed"].notify_all()
+
+# Park on the room's condition until its version differs from `since`
+def wait_for_version(room, since, timeout):
+    with room["changed"]:
+        room["changed"].wait_for(lambda: room["version"] != since or draining.is_set(), timeout=timeout)
+        return room["version"]
+
+# Updates pushed to clients are either a snapshot
+#     {"v": version, "p": players, "b": board, "t": player to move, "r": result}
+# where "b"/"t" appear once the game started (the board is 9 chars, ' ' for
+# empty) and "r" once it is over, or the deltas since the client's version
+#     {"v": version, "d": [{"v", "c": cell, "m": mark, "t" or "r"}, ...]}
+# "a" names the player who abandoned the game and a delta carrying "x" means
+# the room was closed.
+def room_snapshot(room):
+    with room["lock"]:
+        message = {"v": room["version"], "p": list(room["players"])}
+        game_state = room["state"]
+        if game_state:
+            message["b"] = game_state.text()
+            message["t"] = game_state.current_player
+            if game_state.game_over:
+                message["r"] = game_state.result
+            if room.get('abandoned'):
+                message["a"] = room['abandoned']
+        return message
+
+def encode_update(update):
+    return json.dumps(update, separators=(',', ':'))
+
+# Stream of (version, payload, closed) for a room: first whatever a client at
+# `since` missed, then every published change. Yields None when nothing
+# happened for `timeout` seconds and stops if the hub evicts us
+def room_feed(room, since, timeout=15):
+    subscriber = hub.subscribe(room["code"])
+    try:
+        version = since
+        if since != room["version"]:
+            update = room_update(room, since)
+            version = update["v"]
+            yield version, encode_update(update), rooms.get(room["code"]) is not room
+        while not subscriber.evicted:
+            message = subscriber.get(timeout)
+            if message is None:
+                yield None
+            elif message[0] > version:
+                version = message[0]
+                yield message
+    finally:
+        hub.unsubscribe(subscriber)
+
+def room_update(room, since):
+    with room["changed"]:
+        behind = room["version"] - since if since is not None else -1
+        if 0 <= behind <= len(room["changes"]):
+            deltas = [delta for version, delta in list(room["changes"])[len(room["changes"]) - behind:]]
+            if None not in deltas:
+                return {"v": room["version"], "d": deltas}
+        return room_snapshot(room)
+
+# Everything the /wait and /game responses depend on is in (room, version,
+# viewer) plus which representation (page or JSON) was asked for
+def room_etag(room_code, version, nickname, kind):
+    key = f"{boot_id}:{room_code}:{version}:{nickname}:{kind}".encode()
+    return hashlib.blake2b(key, digest_size=12).hexdigest()
+
+def not_modified(etag, cache_control="no-cache"):
+    if not request.if_none_match.contains(etag):
+        return None
+    response = Response(status=304)
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = cache_control
+    response.headers["Vary"] = "Accept"
+    return response
+
+def conditional_page(body, etag, cache_control="no-cache"):
+    response = make_response(body)
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = cache_control
+    response.headers["Vary"] = "Accept"
+    return response
+
+# /game and /wait answer the shell's fetch() with JSON and browsers with the
+# no-script pages
+def wants_json():
+    return request.accept_mimetypes.best == 'application/json'
+
+# Where a browser gets redirected, a JSON client gets told where to go
+def go_to(endpoint, status):
+    if wants_json():
+        return jsonify(redirect=url_for(endpoint)), status
+    return redirect(url_for(endpoint))
+
+def player_view(room_code, snapshot):
+    nickname = session['nickname']
+    etag = room_etag(room_code, snapshot["v"], nickname, 'json')
+    cached = not_modified(etag)
+    if cached:
+        return cached
+    def render():
+        view = {"room": room_code, "me": nickname, "state": snapshot, "websocket": Sock is not None}
+        return json.dumps(view, separators=(',', ':'))
+    body = renders.get(('view', room_code, snapshot["v"], nickname), render)
+    return conditional_page(app.response_class(body, mimetype='application/json'), etag)
 
 def initialize_game(players):
-    game_state = {
-        "board": ['' for _ in range(9)],
-        "current_turn": 'X',
-        "game_over": False,
-        "result": "",
-        "symbols": {players[0]: 'X', players[1]: 'O'},
-        "players": players,
-        "current_player": players[0]
-    }
-    return game_state
-
-def check_win(game_state):
-    win_conditions = [
-        [0, 1, 2], [3, 4, 5], [6, 7, 8],
-        [0, 3, 6], [1, 4, 7], [2, 5, 8],
-        [0, 4, 8], [2, 4, 6]
-    ]
-    for condition in win_conditions:
-        if game_state["board"][condition[0]] == game_state["board"][condition[1]] == game_state["board"][condition[2]] != '':
-            game_state["game_over"] = True
-            winner = game_state["board"][condition[0]]
-            for player, symbol in game_state["symbols"].items():
-                if symbol == winner:
-                    game_state["result"] = f"{player} ({symbol}) wins!"
-                    break
+    return GameState(players)
+
+# Creating, joining, moving, restarting and leaving each hold the room's lock
+# from the first check to the last write, so concurrent requests for one room
+# apply one after another and always see each other's result
+def create_room(nickname):
+    room = rooms.create(generate_code, lambda room_code: new_room(room_code, [nickname]))
+    touch(room)
+    heartbeat(room["code"], nickname)
+    return room["code"]
+
+def join_room(room_code, nickname):
+    with rooms.locked(room_code) as room:
+        # Seats, presence and abandoning all go by nickname, so two players
+        # can't share one
+        if room is None or len(room['players']) >= 2 or nickname in room['players']:
+            return False
+        room['players'].append(nickname)
+        room['state'] = initialize_game(room['players'])
+        notify_room(room)
+    heartbeat(room_code, nickname)
+    return True
+
+# Why play_move() refused a move, and the HTTP status the JSON API answers with
+move_errors = {
+    "room_not_found": 404,
+    "not_a_player": 403,
+    "invalid_cell": 400,
+    "waiting_for_opponent": 409,
+    "game_over": 409,
+    "not_your_turn": 409,
+    "cell_taken": 409,
+}
+
+# Returns None when the move was applied, else one of the move_errors keys
+def play_move(room_code, nickname, cell):
+    with rooms.locked(room_code) as room:
+        if room is None:
+            return "room_not_found"
+        return apply_move(room, nickname, cell)
+
+# Called with the room locked
+def apply_move(room, nickname, cell):
+    if nickname not in room['players']:
+        return "not_a_player"
+    if not isinstance(cell, int) or isinstance(cell, bool) or not 0 <= cell < 9:
+        return "invalid_cell"
+    
+    game_state = room['state']
+    if not game_state:
+        return "waiting_for_opponent"
+    if game_state.game_over:
+        return "game_over"
+    if game_state.current_player != nickname:
+        return "not_your_turn"
+    if game_state.cell(cell):
+        return "cell_taken"
+    
+    delta = {"c": cell, "m": game_state.mark}
+    game_state.play(cell)
+    
+    if not game_state.game_over:
+        delta["t"] = game_state.current_player
+    else:
+        delta["r"] = game_state.result
+    
+    notify_room(room, delta)
+    return None
+
+def restart_room(room_code):
+    with rooms.locked(room_code) as room:
+        if room is None or not room['state'] or room.get('abandoned'):
+            return False
+        room['state'] = initialize_game(room['state'].players)
+        notify_room(room)
+        return True
+
+# The room stays, so the remaining player is told who left. A game still in
+# play ends there; a finished one keeps its result and just can't be restarted
+def abandon_room(room, nickname):
+    room['abandoned'] = nickname
+    if not room['state'].game_over:
+        room['state'].abandon(room['players'].index(nickname))
+    notify_room(room, {"r": room['state'].result, "a": nickname})
+
+# The first player out of a running game abandons it; the room is closed when
+# nobody is left to see the result. Only the room's players can leave it
+def leave_room(room_code, nickname):
+    presence.cancel((room_code, nickname))
+    with rooms.locked(room_code) as room:
+        if room is None or nickname not in room['players']:
+            return
+        if room['state'] and not room.get('abandoned'):
+            abandon_room(room, nickname)
             return
-    if '' not in game_state["board"]:
-        game_state["game_over"] = True
-        game_state["result"] = "It's a draw!"
+        close_room(room)
+
+# Called with the room locked. Everyone still watching is told it closed
+def close_room(room):
+    idle_rooms.cancel(room["code"])
+    rooms.remove(room)
+    codes.release(room["code"])
+    for player in room['players']:
+        presence.cancel((room["code"], player))
+    notify_room(room, {"x": 1})
+
+# The wheel can fire up to a tick early, or just after the room was touched
+def room_expired(room_code):
+    with rooms.locked(room_code) as room:
+        if room is None:
+            return
+        phase = room_phase(room)
+        idle = time.monotonic() - room["active"]
+        if idle < ROOM_TTL[phase] - idle_rooms.tick:
+            idle_rooms.schedule(room_code, ROOM_TTL[phase] - idle)
+            return
+        reaped[phase] += 1
+        close_room(room)
+
+def heartbeat(room_code, nickname, delay=HEARTBEAT_TIMEOUT):
+    presence.schedule((room_code, nickname), delay)
+
+def seat_expired(seat):
+    room_code, nickname = seat
+    room = rooms.get(room_code)
+    if room is not None and nickname in room['players']:
+        leave_room(room_code, nickname)
+
+presence.start(seat_expired)
+idle_rooms.start(room_expired)
+
+# A room as written to the snapshot: just enough to resume the game. Delta
+# history is not kept, so returning clients resync from a full update
+def dump_room(room):
+    with room["lock"]:
+        data = {"c": room["code"], "p": list(room["players"]), "v": room["version"]}
+        game_state = room["state"]
+        if game_state:
+            data["s"] = {"b": game_state.text(), "t": game_state.mark, "n": game_state.current_player,
+                         "o": game_state.game_over, "r": game_state.result}
+        if room.get('abandoned'):
+            data["a"] = room['abandoned']
+        return data
+
+def restore_room(data):
+    room = new_room(data["c"], data["p"])
+    room["version"] = data["v"]
+    if "s" in data:
+        saved = data["s"]
+        room["state"] = GameState.load(room["players"], saved["b"], saved["t"])
+    if "a" in data:
+        room['abandoned'] = data["a"]
+        if room["state"] and not room["state"].game_over and data["a"] in room["players"]:
+            room["state"].abandon(room["players"].index(data["a"]))
+    room["snapshot"] = room_snapshot(room)
+    return room
+
+# Written to a temporary file and renamed over the old one, so a crash
+# mid-write never leaves half a snapshot
+def save_rooms(path=SNAPSHOT_PATH):
+    snapshot = [dump_room(room) for room in list(rooms.values())]
+    if snapshot:
+        with open(path + '.tmp', 'w') as f:
+            json.dump(snapshot, f, separators=(',', ':'))
+        os.replace(path + '.tmp', path)
+    return len(snapshot)
+
+# The rooms in the snapshot at `path` and in any per-process parts of it.
+# The files are removed once read, so a snapshot is restored only once
+def read_snapshot(path=SNAPSHOT_PATH):
+    snapshot = []
+    for part in sorted(glob.glob(glob.escape(os.path.splitext(path)[0]) + '*.json')):
+        with open(part) as f:
+            snapshot += json.load(f)
+        os.remove(part)
+    return snapshot
+
+# Seats still in the game get a full heartbeat timeout to come back
+def load_rooms(snapshot):
+    for data in snapshot:
+        room = restore_room(data)
+        rooms.add(room)
+        codes.claim(room["code"])
+        touch(room)
+        for player in room["players"]:
+            if player != room.get('abandoned'):
+                heartbeat(room["code"], player)
+    return len(snapshot)
+
+def drain():
+    draining.set()
+    hub.close()
+    for room in list(rooms.values()):
+        with room["changed"]:
+            room["changed"].notify_all()
+
+# Keep-alive connections can still bring requests to the old process after a
+# reload; turn them away with a close so the retry reaches the new one
+@app.before_request
+def send_to_successor():
+    if handed_off.is_set():
+        response = make_response(overloaded(1))
+        response.headers["Connection"] = "close"
+        return response
+
+def request_priority():
+    if request.endpoint == 'multiplayer' and request.method == 'POST':
+        return CRITICAL
+    return endpoint_priority.get(request.endpoint, LOW)
+
+@app.before_request
+def admit():
+    if request.endpoint in unlimited_endpoints:
+        return None
+    priority = request_priority()
+    ticket = admission.try_acquire(priority)
+    if ticket is None:
+        return overloaded(admission.retry_after_for(priority))
+    g.admission_ticket = ticket
+
+@app.teardown_request
+def release_admission(error):
+    ticket = g.pop('admission_ticket', None)
+    if ticket is not None:
+        admission.release(ticket)
+
+# The shell's script waits out Retry-After before calling again; a plain
+# page retries through its refresh
+def overloaded(retry_after):
+    headers = {"Retry-After": str(retry_after), "Cache-Control": "no-store"}
+    if wants_json():
+        return jsonify(error="overloaded"), 503, headers
+    page = (f'<!DOCTYPE html><meta http-equiv="refresh" content="{retry_after}">'
+            f'<p>The server is busy, trying again in {retry_after} seconds...</p>')
+    return page, 503, headers
+
+# Any request from a seated player keeps their seat alive
+@app.before_request
+def track_presence():
+    room_code = session.get('room')
+    room = rooms.get(room_code)
+    if room is not None and session.get('nickname') in room['players'] and request.endpoint != 'exit_game':
+        heartbeat(room_code, session['nickname'])
 
 @app.route("/", methods=["GET", "POST"])
 def index():
     if request.method == "POST":
         session['nickname'] = request.form['nickname']
-        session['code'] = generate_code()
         return redirect(url_for('mode_select'))
-    return render_template_string(nickname_form_html)
+    return render_template('nickname_form.html')
 
 @app.route("/mode", methods=["GET"])
 def mode_select():
     if 'nickname' not in session:
         return redirect(url_for('index'))
-    return render_template_string(mode_selection_html, nickname=session['nickname'])
+    return render_template('mode_selection.html', nickname=session['nickname'])
 
 @app.route("/multiplayer", methods=["GET", "POST"])
 def multiplayer():
     if request.method == "POST":
         action = request.form.get('action')
         if action == 'create':
-            room_code = generate_code()
-            session['room'] = room_code
-            rooms[room_code] = {"players": [session['nickname']], "state": None}
-            return redirect(url_for('wait_for_player'))
+            if draining.is_set():
+                return "Server is restarting, try again in a moment", 503, {"Retry-After": "5"}
+            session['room'] = create_room(session['nickname'])
+            return redirect(url_for('play'))
         elif action == 'join':
             room_code = request.form['room_code']
-            if room_code in rooms and len(rooms[room_code]['players']) < 2:
-                rooms[room_code]['players'].append(session['nickname'])
-                rooms[room_code]['state'] = initialize_game(rooms[room_code]['players'])
+            if join_room(room_code, session['nickname']):
                 session['room'] = room_code
-                return redirect(url_for('game'))
+                return redirect(url_for('play'))
             return "Room not found or full"
-    return render_template_string(multiplayer_options_html)
+    return render_template('multiplayer_options.html')
+
+@app.route("/play")
+def play():
+    cached = not_modified(shell_etag, "public, max-age=600")
+    if cached:
+        return cached
+    return conditional_page(shell_html, shell_etag, "public, max-age=600")
 
 @app.route("/wait")
 def wait_for_player():
+    if 'nickname' not in session:
+        return go_to('index', 401)
     room_code = session.get('room')
-    if not room_code or room_code not in rooms:
-        return redirect(url_for('multiplayer'))
-    if len(rooms[room_code]["players"]) == 2:
+    room = rooms.get(room_code)
+    if room is None:
+        return go_to('multiplayer', 404)
+    snapshot = room["snapshot"]
+    if wants_json():
+        return player_view(room_code, snapshot)
+    if len(snapshot["p"]) == 2:
         return redirect(url_for('game'))
-    return render_template_string(wait_html, room=room_code)
+    version = snapshot["v"]
+    etag = room_etag(room_code, version, session.get('nickname'), 'wait')
+    cached = not_modified(etag)
+    if cached:
+        return cached
+    html = renders.get(('wait', room_code, version), lambda: render_template('wait.html', room=room_code))
+    return conditional_page(html, etag)
 
 @app.route("/game")
 def game():
     if 'nickname' not in session:
-        return redirect(url_for('index'))
+        return go_to('index', 401)
     
     if 'room' not in session:
-        return redirect(url_for('multiplayer'))
+        return go_to('multiplayer', 404)
     
     room_code = session['room']
-    if room_code not in rooms:
-        return redirect(url_for('multiplayer'))
+    room = rooms.get(room_code)
+    if room is None:
+        return go_to('multiplayer', 404)
     
-    game_state = rooms[room_code]['state']
-    if not game_state:
+    # One consistent version of the room for everything below, however
+    # many moves land meanwhile
+    snapshot = room["snapshot"]
+    if wants_json():
+        return player_view(room_code, snapshot)
+    
+    if "b" not in snapshot:
         return redirect(url_for('wait_for_player'))
     
-    player_symbol = game_state["symbols"].get(session['nickname'])
-    is_my_turn = (game_state["current_player"] == session['nickname'])
-    opponent = [p for p in game_state["players"] if p != session['nickname']][0]
+    version = snapshot["v"]
+    etag = room_etag(room_code, version, session['nickname'], 'game')
+    cached = not_modified(etag)
+    if cached:
+        return cached
+    
+    def render():
+        return render_template('game.html', **game_page_context(snapshot, session['nickname']))
     
+    html = renders.get(('game', room_code, version, session['nickname']), render)
+    return conditional_page(html, etag)
+
+# Template variables for the game page, from a room snapshot of a started
+# game. The first player is X, as in initialize_game()
+def game_page_context(snapshot, nickname):
+    players = snapshot["p"]
+    symbols = {players[0]: 'X', players[1]: 'O'}
+    player_symbol = symbols.get(nickname)
+    game_over = "r" in snapshot
+    is_my_turn = (snapshot["t"] == nickname)
+    opponent = [p for p in players if p != nickname][0]
+
     status_message = ""
-    if game_state["game_over"]:
+    if game_over:
         status_message = "Game finished!"
     elif is_my_turn:
         status_message = f"Your turn ({player_symbol}) - PLAY NOW!"
     else:
         status_message = f"Waiting for {opponent}'s move..."
-    
-    return render_template_string(game_html,
-                              board=game_state['board'],
-                              game_over=game_state['game_over'],
-                              result=game_state['result'],
-                              nickname=session['nickname'],
-                              player_symbol=player_symbol,
-                              is_my_turn=is_my_turn,
-                              opponent=opponent,
-                              opponent_symbol=game_state["symbols"][opponent],
-                              status_message=status_message)
+
+    return dict(board=[mark.strip() for mark in snapshot["b"]],
+                game_over=game_over,
+                result=snapshot.get("r", ""),
+                nickname=nickname,
+                player_symbol=player_symbol,
+                is_my_turn=is_my_turn,
+                opponent=opponent,
+                opponent_symbol=symbols[opponent],
+                status_message=status_message)
 
 @app.route("/move/<int:cell>")
 def move(cell):
@@ -131,41 +637,227 @@ def move(cell):
     if room_code not in rooms:
         return redirect(url_for('multiplayer'))
     
-    game_state = rooms[room_code]['state']
-    if game_state["current_player"] != session['nickname'] or game_state["game_over"] or game_state["board"][cell] != '':
-        return redirect(url_for('game'))
-    
-    game_state["board"][cell] = game_state["current_turn"]
-    check_win(game_state)
-    
-    if not game_state["game_over"]:
-        game_state["current_turn"] = 'O' if game_state["current_turn"] == 'X' else 'X'
-        game_state["current_player"] = [p for p in game_state["players"] if p != session['nickname']][0]
-    
+    play_move(room_code, session['nickname'], cell)
     return redirect(url_for('game'))
 
+# Apply a move and answer with the resulting state in the same round trip,
+# or with {"error": ..., "state": ...} when it is rejected
+@app.route("/api/rooms/<room_code>/moves", methods=["POST"])
+def api_move(room_code):
+    command = request.get_json(silent=True)
+    if not isinstance(command, dict):
+        command = {}
+    room = rooms.get(room_code)
+    error = play_move(room_code, session.get('nickname'), command.get('cell'))
+    if error:
+        rejection = {"error": error}
+        if room is not None:
+            rejection["state"] = room_snapshot(room)
+        return jsonify(rejection), move_errors[error]
+    return jsonify(room_snapshot(room))
+
+@app.route("/api/rooms/<room_code>/restart", methods=["POST"])
+def api_restart(room_code):
+    room = rooms.get(room_code)
+    if room is None:
+        return jsonify(error="room_not_found"), 404
+    if session.get('nickname') not in room['players']:
+        return jsonify(error="not_a_player"), 403
+    if not restart_room(room_code):
+        error = "game_abandoned" if room.get('abandoned') else "waiting_for_opponent"
+        return jsonify(error=error, state=room_snapshot(room)), 409
+    return jsonify(room_snapshot(room))
+
 @app.route("/restart")
 def restart():
     if 'room' in session:
-        room_code = session['room']
-        if room_code in rooms:
-            players = rooms[room_code]['state']["players"]
-            rooms[room_code]['state'] = initialize_game(players)
+        restart_room(session['room'])
     return redirect(url_for('game'))
 
+@app.route("/rooms/<room_code>/events")
+def room_events(room_code):
+    room = rooms.get(room_code)
+    if room is None:
+        return "Room not found", 404
+    # EventSource resends the last id it saw when it reconnects
+    since = request.headers.get('Last-Event-ID', type=int)
+    if since is None:
+        since = request.args.get('since', room["version"], type=int)
+    # Spectators and dashboards can listen too, but only seats heartbeat
+    seat = session.get('nickname') if session.get('nickname') in room['players'] else None
+
+    def stream(feed):
+        yield "retry: 2000\n\n"
+        try:
+            for message in feed:
+                if seat:
+                    heartbeat(room_code, seat)
+                if message is None:
+                    yield ": keepalive\n\n"
+                    continue
+                version, payload, closed = message
+                if closed:
+                    yield f"event: closed\nid: {version}\ndata: {payload}\n\n"
+                    return
+                yield f"id: {version}\ndata: {payload}\n\n"
+        finally:
+            feed.close()
+            if seat and rooms.get(room_code) is room:
+                heartbeat(room_code, seat, RECONNECT_GRACE)
+
+    return Response(stream(room_feed(room, since, timeout=HEARTBEAT_INTERVAL)), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+# Seconds a long-poll may stay parked: the client's `timeout` if it is a
+# number, but never so long that the seat's heartbeat runs out meanwhile
+def poll_timeout(value, default=20):
+    try:
+        timeout = float(value)
+    except (TypeError, ValueError):
+        timeout = default
+    if not math.isfinite(timeout):
+        timeout = default
+    return max(0.0, min(timeout, HEARTBEAT_TIMEOUT - HEARTBEAT_INTERVAL))
+
+# Long-poll fallback for browsers without SSE or WebSockets: held open
+# until the room version differs from `since` or the timeout fires
+@app.route("/state")
+def room_state():
+    room_code = request.args.get('room') or session.get('room')
+    room = rooms.get(room_code)
+    if room is None:
+        return jsonify(x=1), 404
+    since = request.args.get('since', type=int)
+    if since is not None:
+        wait_for_version(room, since, poll_timeout(request.args.get('timeout')))
+    # Every long-poll parked on this room wakes at once and asks the same question
+    key = ('state', room_code, since, room["version"])
+    body = renders.get(key, lambda: encode_update(room_update(room, since)))
+    response = app.response_class(body, mimetype='application/json')
+    response.headers["Cache-Control"] = "no-store"
+    return response
+
+# For clients that hold no stream open; requests from the player's own
+# session already count through track_presence
+@app.route("/rooms/<room_code>/heartbeat", methods=["POST"])
+def room_heartbeat(room_code):
+    room = rooms.get(room_code)
+    if room is None:
+        return jsonify(x=1), 404
+    if session.get('nickname') not in room['players']:
+        return jsonify(error="not_a_player"), 403
+    heartbeat(room_code, session['nickname'])
+    return "", 204
+
+@app.route("/metrics")
+def metrics():
+    return jsonify(rooms=len(rooms), seats=len(presence), reaped=reaped, codes=codes.stats(), hub=hub.stats(),
+                   renders=renders.stats(), admission=admission.stats())
+
 @app.route("/exit")
 def exit_game():
     if 'room' in session:
-        room_code = session['room']
-        if room_code in rooms:
-            if len(rooms[room_code]['players']) == 2:
-                opponent = [p for p in rooms[room_code]['players'] if p != session['nickname']][0]
-                rooms[room_code]['state']['game_over'] = True
-                rooms[room_code]['state']['result'] = f"⚠️ {session['nickname']} left the game. Returning to multiplayer..."
-            del rooms[room_code]
+        leave_room(session['room'], session.get('nickname'))
     session.pop('room', None)
     return redirect(url_for('multiplayer'))
 
+# One command frame from a seat's socket. Returns the error to send back (or
+# None) and whether the seat left the room
+def room_command(room_code, nickname, text):
+    try:
+        command = json.loads(text)
+        action = command["action"]
+    except (TypeError, ValueError, KeyError):
+        return encode_update({"error": "Expected {\"action\": \"move\" | \"restart\" | \"exit\"}"}), False
+    heartbeat(room_code, nickname)
+    if action == 'move':
+        cell = command.get('cell')
+        error = play_move(room_code, nickname, cell)
+        if error:
+            return encode_update({"error": error, "cell": cell}), False
+    elif action == 'restart':
+        if not restart_room(room_code):
+            return encode_update({"error": "Nothing to restart"}), False
+    elif action == 'exit':
+        leave_room(room_code, nickname)
+        return None, True
+    else:
+        return encode_update({"error": f"Unknown action {action!r}"}), False
+    return None, False
+
+if Sock is not None:
+    sock = Sock(app)
+
+    @sock.route("/rooms/<room_code>/ws")
+    def room_socket(ws, room_code):
+        nickname = session.get('nickname')
+        room = rooms.get(room_code)
+        if room is None or nickname not in room['players']:
+            ws.close(reason=1008, message="Not a player in this room")
+            return
+        # Small frames both ways; don't let Nagle hold pushed boards back
+        ws.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+        # One frame at a time, and none once this side has started closing:
+        # the handler returning (flask-sock closes the socket then) and the
+        # push thread closing after the room did each set `done` first
+        send_lock = threading.Lock()
+        done = threading.Event()
+        def send(payload):
+            with send_lock:
+                if done.is_set() or not ws.connected:
+                    return
+                try:
+                    ws.send(payload)
+                except LocalProtocolError:
+                    # The client's close frame got in first
+                    done.set()
+
+        def close():
+            with send_lock:
+                if not done.is_set() and ws.connected:
+                    done.set()
+                    ws.close()
+
+        # Push what changed to this seat every time the room version moves;
+        # a client reconnecting with ?since= only gets what it missed
+        def push_updates(since):
+            feed = room_feed(room, since, timeout=HEARTBEAT_INTERVAL)
+            try:
+                for message in feed:
+                    if done.is_set() or not ws.connected:
+                        return
+                    heartbeat(room_code, nickname)
+                    if message is None:
+                        continue
+                    version, payload, closed = message
+                    send(payload)
+                    if closed:
+                        break
+                close()
+            except ConnectionClosed:
+                pass
+            finally:
+                feed.close()
+
+        since = request.args.get('since', type=int)
+        threading.Thread(target=push_updates, args=(since,), daemon=True).start()
+        try:
+            serve_commands(ws, room_code, nickname, send)
+        finally:
+            with send_lock:
+                done.set()
+            if nickname in rooms.get(room_code, {}).get('players', ()):
+                heartbeat(room_code, nickname, RECONNECT_GRACE)
+
+    def serve_commands(ws, room_code, nickname, send):
+        while True:
+            reply, left = room_command(room_code, nickname, ws.receive())
+            if reply:
+                send(reply)
+            if left:
+                return
+
 # HTML Templates
 nickname_form_html = '''
 <!DOCTYPE html>
@@ -612,6 +1304,12 @@ game_html = '''
             border: 3px solid var(--dark);
             transition: all 0.2s;
         }
+        td a {
+            display: block;
+            line-height: 80px;
+            color: inherit;
+            text-decoration: none;
+        }
         td:hover {
             background: rgba(0, 0, 0, 0.05);
         }
@@ -636,6 +1334,7 @@ game_html = '''
             cursor: pointer;
             transition: all 0.3s;
             border: none;
+            text-decoration: none;
         }
         .btn-restart {
             background: var(--primary);
@@ -680,29 +1379,558 @@ game_html = '''
         <table {% if not is_my_turn or game_over %}class="disabled"{% endif %}>
             <tr>
                 {% for i in range(3) %}
-                <td onclick="location.href='/move/{{ i }}'">{{ board[i] }}</td>
+                <td><a href="/move/{{ i }}">{{ board[i] }}</a></td>
                 {% endfor %}
             </tr>
             <tr>
                 {% for i in range(3,6) %}
-                <td onclick="location.href='/move/{{ i }}'">{{ board[i] }}</td>
+                <td><a href="/move/{{ i }}">{{ board[i] }}</a></td>
                 {% endfor %}
             </tr>
             <tr>
                 {% for i in range(6,9) %}
-                <td onclick="location.href='/move/{{ i }}'">{{ board[i] }}</td>
+                <td><a href="/move/{{ i }}">{{ board[i] }}</a></td>
                 {% endfor %}
             </tr>
         </table>
 
         <div class="actions">
-            <button class="btn btn-restart" onclick="location.href='/restart'">Restart</button>
+            <a class="btn btn-restart" href="/restart">Restart</a>
+            <a class="btn btn-exit" href="/exit">Exit</a>
+        </div>
+    </div>
+</body>
+</html>
+'''
+
+# Served once and cached: everything after the first load is JSON from
+# /game and compact updates over WebSocket, SSE or /state long-polling
+shell_html = '''
+<!DOCTYPE html>
+<html>
+<head>
+    <title>Tic Tac Toe | Game</title>
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <noscript><meta http-equiv="refresh" content="0; url=/game"></noscript>
+    <style>
+        :root {
+            --primary: #28a745;
+            --secondary: #ff9a44;
+            --dark: #2c3e50;
+            --light: #f8f9fa;
+            --success: #28a745;
+            --danger: #dc3545;
+            --warning: #ffc107;
+        }
+        body {
+            background: linear-gradient(135deg, var(--primary), var(--secondary));
+            margin: 0;
+            padding: 20px;
+            min-height: 100vh;
+            display: flex;
+            justify-content: center;
+            align-items: center;
+            font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif;
+        }
+        .game-container {
+            background: rgba(255, 255, 255, 0.95);
+            border-radius: 15px;
+            padding: 25px;
+            width: 100%;
+            max-width: 400px;
+            box-shadow: 0 10px 30px rgba(0, 0, 0, 0.2);
+            text-align: center;
+        }
+        .player-info {
+            display: flex;
+            justify-content: space-between;
+            margin-bottom: 20px;
+            gap: 10px;
+        }
+        .player {
+            padding: 10px 15px;
+            border-radius: 8px;
+            font-weight: 600;
+            flex: 1;
+            text-align: center;
+        }
+        .player.me {
+            background: rgba(40, 167, 69, 0.1);
+            color: var(--primary);
+        }
+        .player.opponent {
+            background: rgba(255, 154, 68, 0.1);
+            color: var(--secondary);
+        }
+        .status {
+            padding: 12px;
+            border-radius: 8px;
+            font-weight: 600;
+            margin: 15px 0;
+        }
+        .status.your-turn {
+            background: var(--success);
+            color: white;
+        }
+        .status.waiting {
+            background: var(--warning);
+            color: var(--dark);
+        }
+        .status.game-over {
+            background: var(--dark);
+            color: white;
+        }
+        .result {
+            font-size: 18px;
+            font-weight: 700;
+            margin: 15px 0;
+            color: var(--primary);
+        }
+        table {
+            margin: 20px auto;
+            border-collapse: collapse;
+        }
+        td {
+            width: 80px;
+            height: 80px;
+            text-align: center;
+            font-size: 36px;
+            font-weight: 700;
+            cursor: pointer;
+            border: 3px solid var(--dark);
+            transition: all 0.2s;
+        }
+        td:hover {
+            background: rgba(0, 0, 0, 0.05);
+        }
+        td:active {
+            transform: scale(0.95);
+        }
+        .disabled td {
+            pointer-events: none;
+            opacity: 0.7;
+        }
+        .actions {
+            display: flex;
+            gap: 10px;
+            margin-top: 20px;
+        }
+        .btn {
+            flex: 1;
+            padding: 12px;
+            border-radius: 8px;
+            font-size: 16px;
+            font-weight: 600;
+            cursor: pointer;
+            transition: all 0.3s;
+            border: none;
+        }
+        .btn-restart {
+            background: var(--primary);
+            color: white;
+        }
+        .btn-restart:hover {
+            background: #218838;
+            transform: translateY(-2px);
+        }
+        .btn-exit {
+            background: var(--danger);
+            color: white;
+        }
+        .btn-exit:hover {
+            background: #c82333;
+            transform: translateY(-2px);
+        }
+        @media (max-width: 480px) {
+            td {
+                width: 70px;
+                height: 70px;
+                font-size: 32px;
+            }
+        }
+        h2 {
+            color: var(--dark);
+            margin-bottom: 15px;
+            font-weight: 600;
+        }
+        .room-code {
+            font-size: 24px;
+            font-weight: 700;
+            color: var(--primary);
+            margin: 20px 0;
+            padding: 10px;
+            background: rgba(40, 167, 69, 0.1);
+            border-radius: 8px;
+            display: inline-block;
+        }
+        .loader {
+            border: 5px solid #f3f3f3;
+            border-top: 5px solid var(--primary);
+            border-radius: 50%;
+            width: 50px;
+            height: 50px;
+            animation: spin 1s linear infinite;
+            margin: 20px auto;
+        }
+        @keyframes spin {
+            0% { transform: rotate(0deg); }
+            100% { transform: rotate(360deg); }
+        }
+    </style>
+</head>
+<body>
+    <div id="waiting" class="game-container" hidden>
+        <h2>Waiting for Opponent</h2>
+        <p>Share this room code:</p>
+        <div id="room-code" class="room-code"></div>
+        <div class="loader"></div>
+        <div class="actions">
+            <button class="btn btn-exit" onclick="location.href='/exit'">Cancel</button>
+        </div>
+    </div>
+
+    <div id="game" class="game-container" hidden>
+        <div class="player-info">
+            <div id="me" class="player me"></div>
+            <div id="opponent" class="player opponent"></div>
+        </div>
+
+        <div id="status" class="status"></div>
+
+        <div id="result" class="result" hidden></div>
+
+        <table id="board" class="disabled">
+            <tr><td onclick="play(0)"></td><td onclick="play(1)"></td><td onclick="play(2)"></td></tr>
+            <tr><td onclick="play(3)"></td><td onclick="play(4)"></td><td onclick="play(5)"></td></tr>
+            <tr><td onclick="play(6)"></td><td onclick="play(7)"></td><td onclick="play(8)"></td></tr>
+        </table>
+
+        <div class="actions">
+            <button id="restart" class="btn btn-restart" onclick="restart()">Restart</button>
             <button class="btn btn-exit" onclick="location.href='/exit'">Exit</button>
         </div>
     </div>
+    <script>
+        var view = null, state = null, socket = null, events = null;
+
+        // A 503 means the server is shedding load: ask again once its
+        // Retry-After has passed
+        function call(method, url, body, done) {
+            var xhr = new XMLHttpRequest();
+            xhr.open(method, url);
+            xhr.setRequestHeader('Accept', 'application/json');
+            if (body) {
+                xhr.setRequestHeader('Content-Type', 'application/json');
+            }
+            xhr.onload = function () {
+                if (xhr.status === 503) {
+                    var wait = parseInt(xhr.getResponseHeader('Retry-After'), 10) || 2;
+                    setTimeout(function () { call(method, url, body, done); }, wait * 1000);
+                    return;
+                }
+                done(xhr.status, JSON.parse(xhr.responseText || 'null'));
+            };
+            xhr.onerror = function () {
+                done(0, null);
+            };
+            xhr.send(body ? JSON.stringify(body) : null);
+        }
+
+        // Updates are a full snapshot (has "p") or deltas since our version
+        function apply(update) {
+            if (update.p) {
+                state = update;
+            } else {
+                update.d.forEach(function (delta) {
+                    if ('c' in delta) {
+                        state.b = state.b.slice(0, delta.c) + delta.m + state.b.slice(delta.c + 1);
+                    }
+                    if (delta.t) {
+                        state.t = delta.t;
+                    }
+                    if (delta.r) {
+                        state.r = delta.r;
+                    }
+                    if (delta.a) {
+                        state.a = delta.a;
+                    }
+                    if (delta.x) {
+                        state.x = 1;
+                    }
+                });
+                state.v = update.v;
+            }
+            render();
+        }
+
+        function render() {
+            if (state.x) {
+                location.href = '/multiplayer';
+                return;
+            }
+            document.getElementById('waiting').hidden = !!state.b;
+            document.getElementById('game').hidden = !state.b;
+            if (!state.b) {
+                document.getElementById('room-code').textContent = view.room;
+                return;
+            }
+            var seat = state.p.indexOf(view.me);
+            var mySymbol = seat === 0 ? 'X' : 'O', opponent = state.p[1 - seat];
+            document.getElementById('me').textContent = view.me + ' (' + mySymbol + ')';
+            document.getElementById('opponent').textContent = opponent + ' (' + (seat === 0 ? 'O' : 'X') + ')';
+
+            var gameOver = 'r' in state;
+            var myTurn = state.t === view.me && !gameOver;
+            var cells = document.querySelectorAll('#board td');
+            for (var i = 0; i < 9; i++) {
+                cells[i].textContent = state.b[i].trim();
+            }
+            document.getElementById('board').className = myTurn ? '' : 'disabled';
+            var status = document.getElementById('status');
+            if (gameOver) {
+                status.className = 'status game-over';
+                status.textContent = 'Game finished!';
+            } else if (myTurn) {
+                status.className = 'status your-turn';
+                status.textContent = 'Your turn (' + mySymbol + ') - PLAY NOW!';
+            } else {
+                status.className = 'status waiting';
+                status.textContent = 'Waiting for ' + opponent + "'s move...";
+            }
+            var result = document.getElementById('result');
+            result.textContent = state.r || '';
+            result.hidden = !gameOver;
+            document.getElementById('restart').hidden = !!state.a;
+        }
+
+        function play(cell) {
+            if (socket && socket.readyState === WebSocket.OPEN) {
+                socket.send(JSON.stringify({action: 'move', cell: cell}));
+                return;
+            }
+            call('POST', '/api/rooms/' + view.room + '/moves', {cell: cell}, function (status, reply) {
+                if (reply && (reply.state || !reply.error)) {
+                    apply(reply.state || reply);
+                }
+            });
+        }
+
+        function restart() {
+            if (socket && socket.readyState === WebSocket.OPEN) {
+                socket.send(JSON.stringify({action: 'restart'}));
+                return;
+            }
+            call('POST', '/api/rooms/' + view.room + '/restart', null, function (status, reply) {
+                if (reply && (reply.state || !reply.error)) {
+                    apply(reply.state || reply);
+                }
+            });
+        }
+
+        function poll() {
+            call('GET', '/state?room=' + view.room + '&since=' + state.v, null, function (status, reply) {
+                if (status === 0) {
+                    setTimeout(poll, 3000);
+                    return;
+                }
+                apply(status === 200 ? reply : {v: state.v, d: [{x: 1}]});
+                if (!state.x) {
+                    poll();
+                }
+            });
+        }
+
+        function listen() {
+            if (events) {
+                return;
+            }
+            if (window.EventSource) {
+                events = new EventSource('/rooms/' + view.room + '/events?since=' + state.v);
+                events.onmessage = function (event) { apply(JSON.parse(event.data)); };
+                events.addEventListener('closed', function (event) { apply(JSON.parse(event.data)); });
+                // EventSource gives up for good on a non-200 answer, e.g. the 404
+                // for a room closed or lost while it was reconnecting; polling
+                // finds out which and keeps going otherwise
+                events.onerror = function () {
+                    if (events.readyState === EventSource.CLOSED) {
+                        poll();
+                    }
+                };
+            } else {
+                poll();
+            }
+        }
+
+        function connect() {
+            if (!view.websocket || !window.WebSocket) {
+                listen();
+                return;
+            }
+            var scheme = location.protocol === 'https:' ? 'wss://' : 'ws://';
+            socket = new WebSocket(scheme + location.host + '/rooms/' + view.room + '/ws?since=' + state.v);
+            socket.onmessage = function (event) {
+                var message = JSON.parse(event.data);
+                if (!message.error) {
+                    apply(message);
+                }
+            };
+            socket.onclose = function () {
+                socket = null;
+                listen();
+            };
+        }
+
+        call('GET', '/game', null, function (status, reply) {
+            if (status !== 200) {
+                location.href = reply && reply.redirect ? reply.redirect : '/multiplayer';
+                return;
+            }
+            view = reply;
+            apply(view.state);
+            connect();
+        });
+    </script>
 </body>
 </html>
 '''
 
+shell_etag = hashlib.blake2b(shell_html.encode(), digest_size=12).hexdigest()
+
+# Jinja compiles a page the first time it is rendered and keeps it, so
+# startup doesn't pay for pages nobody has asked for yet
+pages = {
+    'nickname_form.html': nickname_form_html,
+    'mode_selection.html': mode_selection_html,
+    'multiplayer_options.html': multiplayer_options_html,
+    'wait.html': wait_html,
+    'game.html': game_html,
+}
+app.jinja_loader = DictLoader(pages)
+
+def record_startup(phase, started):
+    finished = time.perf_counter()
+    startup_phases.append((phase, started, finished))
+    if profile_startup:
+        print_startup_phase(phase, started, finished)
+    return finished
+
+def print_startup_phase(phase, started, finished):
+    print(f" * {phase:<34} at {(started - boot_started) * 1000:6.1f} ms, took {(finished - started) * 1000:6.1f} ms")
+
+# Compile every page once the server is listening, off the request path,
+# so the first visitor to each page doesn't wait for it either
+def warm_up():
+    started = time.perf_counter()
+    for name in pages:
+        app.jinja_env.get_template(name)
+    record_startup("compile pages (background)", started)
+
+record_startup("set up routes and pages", startup_phases[-1][2])
+
+# The development server, stopped gracefully by SIGTERM or Ctrl+C: stop
+# accepting, give in-flight requests up to DRAIN_TIMEOUT, save the rooms.
+#
+# SIGHUP reloads the code without dropping a game or a connection: a new
+# process is started on the same listening socket and, once it has imported
+# everything, this one stops accepting (connections wait in the backlog),
+# drains, and sends it the rooms over a socket pair. Sessions live in the
+# signed cookie, so they carry over as they are
+def run(host="0.0.0.0", port=5000, profile=False):
+    global profile_startup
+    profile_startup = profile
+    if profile:
+        for phase in startup_phases:
+            print_startup_phase(*phase)
+
+    started = time.perf_counter()
+    handoff = os.environ.pop('V12_HANDOFF', None)
+    if handoff:
+        listen_fd, channel_fd = map(int, handoff.split(','))
+        channel = socket.socket(fileno=channel_fd)
+    else:
+        listen_fd = None
+        restored = load_rooms(read_snapshot())
+        if restored:
+            print(f"Restored {restored} rooms from {SNAPSHOT_PATH}")
+    started = record_startup("restore rooms", started)
+
+    in_flight = [0]
+    done = threading.Condition()
+    first_request = []
+    def counted(environ, start_response):
+        request_started = time.perf_counter()
+        with done:
+            in_flight[0] += 1
+        try:
+            return app(environ, start_response)
+        finally:
+            with done:
+                in_flight[0] -= 1
+                done.notify_all()
+                if not first_request:
+                    first_request.append(record_startup("first request", request_started))
+
+    server = make_server(host, port, counted, threaded=True, fd=listen_fd)
+    ready = record_startup("listen", started) - boot_started
+    threading.Thread(target=warm_up, daemon=True).start()
+    if profile:
+        verdict = "within" if ready <= STARTUP_BUDGET else "over"
+        print(f" * Ready {ready * 1000:.0f} ms after start, {verdict} the {STARTUP_BUDGET * 1000:.0f} ms budget")
+    if handoff:
+        channel.sendall(b'ready')
+        received = b''.join(iter(lambda: channel.recv(65536), b''))
+        channel.close()
+        print(f"Reloaded with {load_rooms(json.loads(received or b'[]'))} rooms")
+
+    def stop(signum, frame):
+        drain()
+        threading.Thread(target=server.shutdown, daemon=True).start()
+
+    successor = []
+    def hand_over():
+        ours, theirs = socket.socketpair()
+        fds = (server.fileno(), theirs.fileno())
+        subprocess.Popen([sys.executable] + sys.argv, pass_fds=fds,
+                         env=dict(os.environ, V12_HANDOFF=f"{fds[0]},{fds[1]}"))
+        theirs.close()
+        if ours.recv(16) != b'ready':
+            print("Reload failed: the new process did not start. Still serving")
+            return
+        successor.append(ours)
+        server.shutdown()
+        handed_off.set()
+        drain()
+
+    def reload(signum, frame):
+        if not successor:
+            threading.Thread(target=hand_over, daemon=True).start()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGHUP, reload)
+
+    print(f" * Running on http://{host}:{port}")
+    server.serve_forever()
+    with done:
+        done.wait_for(lambda: in_flight[0] == 0, timeout=DRAIN_TIMEOUT)
+    if successor:
+        successor[0].sendall(json.dumps([dump_room(room) for room in list(rooms.values())]).encode())
+        successor[0].close()
+        return
+    print(f"Saved {save_rooms()} rooms to {SNAPSHOT_PATH}")
+
+# `python -m v12` starts a little faster than `python v12.py`: only a
+# module that is imported gets its compiled bytecode cached
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=5000)
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Serve v12 with the development server")
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--profile-startup', action='store_true',
+                        help="print how long each import and startup step takes")
+    for phase, ttl in ROOM_TTL.items():
+        parser.add_argument(f'--{phase}-ttl', type=float, default=ttl,
+                            help=f"seconds a room may stay {phase} without a change before it is closed")
+    args = parser.parse_args()
+    for phase in ROOM_TTL:
+        ROOM_TTL[phase] = getattr(args, f'{phase}_ttl')
+    run(args.host, args.port, args.profile_startup)
\ No newline at end of file
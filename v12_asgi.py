@@ -0,0 +1,609 @@
+import asyncio
+import json
+import re
+import threading
+from http.cookies import SimpleCookie
+from urllib.parse import parse_qsl, quote
+
+import uvicorn
+from itsdangerous import BadSignature
+
+import v12
+from v12 import rooms, hub, renders, presence, heartbeat
+
+# ASGI flavour of v12: the same rooms, game logic and pages, served as
+# coroutines on one event loop instead of a thread per request. A phone
+# parked on a long-poll, event stream or WebSocket is a suspended task, so one
+# process can hold ten thousand of them open.
+#
+#   uvicorn v12_asgi:app --host 0.0.0.0 --port 5000
+#   python v12_asgi.py
+#
+# Sessions are Flask's own signed cookies, so a client can move between this
+# and the Flask app (python v12.py / serve.py) when they share a secret key.
+# Room state lives in v12's module globals; everything that wakes a waiter
+# goes through hub.publish, which the listener below bridges into the loop.
+
+session_serializer = v12.app.session_interface.get_signing_serializer(v12.app)
+session_cookie = v12.app.config['SESSION_COOKIE_NAME']
+
+# v12's pages, compiled on first use and cached by Jinja
+def render(name, **context):
+    return v12.app.jinja_env.get_template(name).render(**context)
+
+loop = None
+# Where this process saves its rooms on shutdown; cluster workers each get
+# their own part of the snapshot
+snapshot_path = v12.SNAPSHOT_PATH
+# Long-polls parked per room, and the streams (SSE/WebSocket) subscribed to it
+waiters = {}
+streams = {}
+evicted = 0
+
+
+class Request:
+    def __init__(self, scope, body=b''):
+        self.scope = scope
+        self.method = scope.get('method', 'GET')
+        self.path = scope['path']
+        self.headers = {name.decode('latin-1'): value.decode('latin-1') for name, value in scope['headers']}
+        self.args = dict(parse_qsl(scope['query_string'].decode('latin-1')))
+        self.body = body
+        self.session = load_session(self.headers.get('cookie', ''))
+
+    @property
+    def form(self):
+        return dict(parse_qsl(self.body.decode()))
+
+    def get_json(self):
+        try:
+            return json.loads(self.body)
+        except ValueError:
+            return None
+
+    def int_arg(self, name, default=None):
+        try:
+            return int(self.args[name])
+        except (KeyError, ValueError):
+            return default
+
+    # Same test as v12.wants_json: JSON is the best match of the Accept header
+    def wants_json(self):
+        best, best_quality = None, 0
+        for item in self.headers.get('accept', '').split(','):
+            mimetype, _, params = item.strip().partition(';')
+            quality = 1.0
+            match = re.search(r'q=([\d.]+)', params)
+            if match:
+                quality = float(match.group(1))
+            if quality > best_quality:
+                best, best_quality = mimetype.strip(), quality
+        return best == 'application/json'
+
+    def if_none_match(self, etag):
+        tags = [tag.strip().removeprefix('W/') for tag in self.headers.get('if-none-match', '').split(',')]
+        return '*' in tags or f'"{etag}"' in tags
+
+
+class Session(dict):
+    modified = False
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self.modified = True
+
+    def pop(self, key, default=None):
+        if key in self:
+            self.modified = True
+        return super().pop(key, default)
+
+
+def load_session(cookie_header):
+    morsel = SimpleCookie(cookie_header).get(session_cookie)
+    if morsel is not None:
+        try:
+            return Session(session_serializer.loads(morsel.value))
+        except BadSignature:
+            pass
+    return Session()
+
+
+class Response:
+    def __init__(self, body='', status=200, content_type='text/html; charset=utf-8', headers=None):
+        self.body = body.encode() if isinstance(body, str) else body
+        self.status = status
+        self.headers = [('content-type', content_type)] if content_type else []
+        self.headers += list((headers or {}).items())
+
+
+# The body comes from an async iterator of str chunks
+class StreamingResponse(Response):
+    def __init__(self, chunks, content_type, headers=None):
+        super().__init__(b'', 200, content_type, headers)
+        self.chunks = chunks
+
+
+def json_response(value, status=200, headers=None):
+    return Response(json.dumps(value, separators=(',', ':')), status, 'application/json', headers)
+
+def redirect(location):
+    return Response(f'Redirecting to <a href="{location}">{location}</a>', 302, headers={'location': location})
+
+# Where a browser gets redirected, a JSON client gets told where to go
+def go_to(request, location, status):
+    if request.wants_json():
+        return json_response({"redirect": location}, status)
+    return redirect(location)
+
+# Checked before a page is rendered, as v12.not_modified() is
+def not_modified(request, etag, cache_control="no-cache"):
+    if not request.if_none_match(etag):
+        return None
+    return Response(b'', 304, None, {'etag': f'"{etag}"', 'cache-control': cache_control, 'vary': 'Accept'})
+
+def conditional_page(request, body, etag, cache_control="no-cache", content_type='text/html; charset=utf-8'):
+    cached = not_modified(request, etag, cache_control)
+    if cached is not None:
+        return cached
+    return Response(body, 200, content_type, {'etag': f'"{etag}"', 'cache-control': cache_control, 'vary': 'Accept'})
+
+
+routes = []
+
+def route(path, methods=('GET',)):
+    pattern = re.compile('^' + re.sub(r'<(int:)?(\w+)>', lambda m: f"(?P<{m.group(2)}>{'[0-9]+' if m.group(1) else '[^/]+'})",
+                                      path) + '$')
+    def register(handler):
+        routes.append((pattern, methods, handler))
+        return handler
+    return register
+
+def find_route(path):
+    for pattern, methods, handler in routes:
+        match = pattern.match(path)
+        if match:
+            return methods, handler, match.groupdict()
+    return None, None, None
+
+
+# Runs in whichever thread published (the loop itself, or the presence
+# ticker closing a room); hops onto the loop before touching any waiter
+def on_publish(topic, message):
+    if loop is not None and not loop.is_closed():
+        loop.call_soon_threadsafe(deliver, topic, message)
+
+def deliver(topic, message):
+    global evicted
+    for future in waiters.pop(topic, ()):
+        if not future.done():
+            future.set_result(None)
+    for stream in list(streams.get(topic, ())):
+        try:
+            stream.put_nowait(message)
+        except asyncio.QueueFull:
+            stream.evicted = True
+            unsubscribe(topic, stream)
+            evicted += 1
+
+hub.add_listener(on_publish)
+
+
+class Stream(asyncio.Queue):
+    evicted = False
+
+def subscribe(topic):
+    stream = Stream(hub.queue_size)
+    streams.setdefault(topic, set()).add(stream)
+    return stream
+
+def unsubscribe(topic, stream):
+    subscribers = streams.get(topic)
+    if subscribers is not None:
+        subscribers.discard(stream)
+        if not subscribers:
+            del streams[topic]
+
+# Suspend until the room version differs from `since`
+async def wait_for_version(room, since, timeout):
+    if room["version"] != since or v12.draining.is_set():
+        return
+    future = loop.create_future()
+    waiters.setdefault(room["code"], set()).add(future)
+    try:
+        await asyncio.wait_for(future, timeout)
+    except asyncio.TimeoutError:
+        parked = waiters.get(room["code"])
+        if parked is not None:
+            parked.discard(future)
+            if not parked:
+                del waiters[room["code"]]
+
+# Same contract as v12.room_feed, as an async generator
+async def room_feed(room, since, timeout=v12.HEARTBEAT_INTERVAL):
+    stream = subscribe(room["code"])
+    try:
+        version = since
+        if since != room["version"]:
+            update = v12.room_update(room, since)
+            version = update["v"]
+            yield version, v12.encode_update(update), rooms.get(room["code"]) is not room
+        while not stream.evicted:
+            try:
+                message = await asyncio.wait_for(stream.get(), timeout)
+            except asyncio.TimeoutError:
+                yield None
+                continue
+            if message is None:
+                break
+            if message[0] > version:
+                version = message[0]
+                yield message
+    finally:
+        unsubscribe(room["code"], stream)
+
+# Shutdown has started: let every parked long-poll answer and end every
+# stream (a None in its queue), so uvicorn is not left waiting on them
+def drain():
+    v12.drain()
+    for parked in waiters.values():
+        for future in parked:
+            if not future.done():
+                future.set_result(None)
+    waiters.clear()
+    for subscribers in list(streams.values()):
+        for stream in list(subscribers):
+            stream.evicted = True
+            try:
+                stream.put_nowait(None)
+            except asyncio.QueueFull:
+                pass
+
+
+def seat_of(request, room):
+    nickname = request.session.get('nickname')
+    return nickname if nickname in room['players'] else None
+
+def player_view(request, room_code, snapshot):
+    nickname = request.session['nickname']
+    etag = v12.room_etag(room_code, snapshot["v"], nickname, 'json')
+    cached = not_modified(request, etag)
+    if cached is not None:
+        return cached
+    def render():
+        view = {"room": room_code, "me": nickname, "state": snapshot, "websocket": True}
+        return json.dumps(view, separators=(',', ':'))
+    body = renders.get(('view', room_code, snapshot["v"], nickname), render)
+    return conditional_page(request, body, etag, content_type='application/json')
+
+@route("/", methods=("GET", "POST"))
+async def index(request):
+    if request.method == "POST":
+        request.session['nickname'] = request.form['nickname']
+        return redirect('/mode')
+    return Response(render('nickname_form.html'))
+
+@route("/mode")
+async def mode_select(request):
+    if 'nickname' not in request.session:
+        return redirect('/')
+    return Response(render('mode_selection.html', nickname=request.session['nickname']))
+
+@route("/multiplayer", methods=("GET", "POST"))
+async def multiplayer(request):
+    if request.method == "POST":
+        action = request.form.get('action')
+        if action == 'create':
+            if v12.draining.is_set():
+                return Response("Server is restarting, try again in a moment", 503, headers={'retry-after': '5'})
+            request.session['room'] = v12.create_room(request.session['nickname'])
+            return redirect('/play')
+        elif action == 'join':
+            room_code = request.form['room_code']
+            if v12.join_room(room_code, request.session['nickname']):
+                request.session['room'] = room_code
+                return redirect('/play')
+            return Response("Room not found or full")
+    return Response(render('multiplayer_options.html'))
+
+@route("/play")
+async def play(request):
+    return conditional_page(request, v12.shell_html, v12.shell_etag, "public, max-age=600")
+
+@route("/wait")
+async def wait_for_player(request):
+    if 'nickname' not in request.session:
+        return go_to(request, '/', 401)
+    room_code = request.session.get('room')
+    room = rooms.get(room_code)
+    if room is None:
+        return go_to(request, '/multiplayer', 404)
+    snapshot = room["snapshot"]
+    if request.wants_json():
+        return player_view(request, room_code, snapshot)
+    if len(snapshot["p"]) == 2:
+        return redirect('/game')
+    version = snapshot["v"]
+    etag = v12.room_etag(room_code, version, request.session.get('nickname'), 'wait')
+    cached = not_modified(request, etag)
+    if cached is not None:
+        return cached
+    html = renders.get(('wait', room_code, version), lambda: render('wait.html', room=room_code))
+    return conditional_page(request, html, etag)
+
+@route("/game")
+async def game(request):
+    if 'nickname' not in request.session:
+        return go_to(request, '/', 401)
+    room = rooms.get(request.session.get('room'))
+    if room is None:
+        return go_to(request, '/multiplayer', 404)
+    snapshot = room["snapshot"]
+    if request.wants_json():
+        return player_view(request, room["code"], snapshot)
+    if "b" not in snapshot:
+        return redirect('/wait')
+    nickname = request.session['nickname']
+    version = snapshot["v"]
+    etag = v12.room_etag(room["code"], version, nickname, 'game')
+    cached = not_modified(request, etag)
+    if cached is not None:
+        return cached
+    html = renders.get(('game', room["code"], version, nickname),
+                       lambda: render('game.html', **v12.game_page_context(snapshot, nickname)))
+    return conditional_page(request, html, etag)
+
+@route("/move/<int:cell>")
+async def move(request, cell):
+    room_code = request.session.get('room')
+    if 'nickname' not in request.session or room_code not in rooms:
+        return redirect('/multiplayer')
+    v12.play_move(room_code, request.session['nickname'], int(cell))
+    return redirect('/game')
+
+@route("/api/rooms/<room_code>/moves", methods=("POST",))
+async def api_move(request, room_code):
+    command = request.get_json()
+    if not isinstance(command, dict):
+        command = {}
+    room = rooms.get(room_code)
+    error = v12.play_move(room_code, request.session.get('nickname'), command.get('cell'))
+    if error:
+        rejection = {"error": error}
+        if room is not None:
+            rejection["state"] = v12.room_snapshot(room)
+        return json_response(rejection, v12.move_errors[error])
+    return json_response(v12.room_snapshot(room))
+
+@route("/api/rooms/<room_code>/restart", methods=("POST",))
+async def api_restart(request, room_code):
+    room = rooms.get(room_code)
+    if room is None:
+        return json_response({"error": "room_not_found"}, 404)
+    if request.session.get('nickname') not in room['players']:
+        return json_response({"error": "not_a_player"}, 403)
+    if not v12.restart_room(room_code):
+        error = "game_abandoned" if room.get('abandoned') else "waiting_for_opponent"
+        return json_response({"error": error, "state": v12.room_snapshot(room)}, 409)
+    return json_response(v12.room_snapshot(room))
+
+@route("/restart")
+async def restart(request):
+    if 'room' in request.session:
+        v12.restart_room(request.session['room'])
+    return redirect('/game')
+
+@route("/exit")
+async def exit_game(request):
+    if 'room' in request.session:
+        v12.leave_room(request.session['room'], request.session.get('nickname'))
+    request.session.pop('room', None)
+    return redirect('/multiplayer')
+
+@route("/rooms/<room_code>/events")
+async def room_events(request, room_code):
+    room = rooms.get(room_code)
+    if room is None:
+        return Response("Room not found", 404)
+    since = request.headers.get('last-event-id')
+    since = int(since) if since and since.isdigit() else request.int_arg('since', room["version"])
+    seat = seat_of(request, room)
+
+    async def stream():
+        yield "retry: 2000\n\n"
+        feed = room_feed(room, since)
+        try:
+            async for message in feed:
+                if seat:
+                    heartbeat(room_code, seat)
+                if message is None:
+                    yield ": keepalive\n\n"
+                    continue
+                version, payload, closed = message
+                if closed:
+                    yield f"event: closed\nid: {version}\ndata: {payload}\n\n"
+                    return
+                yield f"id: {version}\ndata: {payload}\n\n"
+        finally:
+            await feed.aclose()
+            if seat and rooms.get(room_code) is room:
+                heartbeat(room_code, seat, v12.RECONNECT_GRACE)
+
+    return StreamingResponse(stream(), "text/event-stream", {"cache-control": "no-cache", "x-accel-buffering": "no"})
+
+@route("/state")
+async def room_state(request):
+    room_code = request.args.get('room') or request.session.get('room')
+    room = rooms.get(room_code)
+    if room is None:
+        return json_response({"x": 1}, 404)
+    since = request.int_arg('since')
+    if since is not None:
+        await wait_for_version(room, since, v12.poll_timeout(request.args.get('timeout')))
+    key = ('state', room_code, since, room["version"])
+    body = renders.get(key, lambda: v12.encode_update(v12.room_update(room, since)))
+    return Response(body, 200, 'application/json', {"cache-control": "no-store"})
+
+@route("/rooms/<room_code>/heartbeat", methods=("POST",))
+async def room_heartbeat(request, room_code):
+    room = rooms.get(room_code)
+    if room is None:
+        return json_response({"x": 1}, 404)
+    if request.session.get('nickname') not in room['players']:
+        return json_response({"error": "not_a_player"}, 403)
+    heartbeat(room_code, request.session['nickname'])
+    return Response(b'', 204, None)
+
+@route("/metrics")
+async def metrics(request):
+    return json_response({"rooms": len(rooms), "seats": len(presence), "reaped": v12.reaped,
+                          "codes": v12.codes.stats(), "hub": hub.stats(), "renders": renders.stats(),
+                          "asgi": {"waiters": sum(map(len, waiters.values())),
+                                   "streams": sum(map(len, streams.values())), "evicted": evicted}})
+
+# Any request from a seated player keeps their seat alive
+def track_presence(request, handler):
+    room_code = request.session.get('room')
+    room = rooms.get(room_code)
+    if room is not None and request.session.get('nickname') in room['players'] and handler is not exit_game:
+        heartbeat(room_code, request.session['nickname'])
+
+
+async def app(scope, receive, send):
+    global loop
+    if loop is None:
+        loop = asyncio.get_running_loop()
+    if scope['type'] == 'http':
+        await serve_http(scope, receive, send)
+    elif scope['type'] == 'websocket':
+        await serve_websocket(scope, receive, send)
+    elif scope['type'] == 'lifespan':
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                restored = v12.load_rooms(v12.read_snapshot(snapshot_path))
+                if restored:
+                    print(f"Restored {restored} rooms from {snapshot_path}")
+                threading.Thread(target=v12.warm_up, daemon=True).start()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                print(f"Saved {v12.save_rooms(snapshot_path)} rooms to {snapshot_path}")
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+async def read_body(receive):
+    body = b''
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return None
+        body += message.get('body', b'')
+        if not message.get('more_body'):
+            return body
+
+async def serve_http(scope, receive, send):
+    methods, handler, params = find_route(scope['path'])
+    if handler is None:
+        response = Response("Not Found", 404)
+    elif scope['method'] not in methods:
+        response = Response("Method Not Allowed", 405)
+    else:
+        body = await read_body(receive)
+        if body is None:
+            return
+        request = Request(scope, body)
+        track_presence(request, handler)
+        try:
+            response = await handler(request, **params)
+        except KeyError:
+            response = Response("Bad Request", 400)
+        if request.session.modified:
+            cookie = quote(session_serializer.dumps(dict(request.session)), safe='.-_')
+            response.headers.append(('set-cookie', f'{session_cookie}={cookie}; HttpOnly; Path=/'))
+
+    await send({'type': 'http.response.start', 'status': response.status,
+                'headers': [(name.encode(), value.encode('latin-1')) for name, value in response.headers]})
+    if not isinstance(response, StreamingResponse):
+        await send({'type': 'http.response.body', 'body': response.body})
+        return
+
+    # The generator sits in a queue wait most of the time, so watch for the
+    # client hanging up separately and cancel the stream when it does
+    async def pump():
+        async for chunk in response.chunks:
+            await send({'type': 'http.response.body', 'body': chunk.encode(), 'more_body': True})
+        await send({'type': 'http.response.body', 'body': b''})
+
+    streaming = asyncio.ensure_future(pump())
+    hangup = asyncio.ensure_future(read_body(receive))
+    try:
+        await asyncio.wait((streaming, hangup), return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        streaming.cancel()
+        hangup.cancel()
+        await asyncio.gather(streaming, hangup, return_exceptions=True)
+        await response.chunks.aclose()
+
+async def serve_websocket(scope, receive, send):
+    match = re.match(r'^/rooms/([^/]+)/ws$', scope['path'])
+    request = Request(scope)
+    room_code = match.group(1) if match else None
+    room = rooms.get(room_code)
+    nickname = request.session.get('nickname')
+    if (await receive())['type'] != 'websocket.connect':
+        return
+    if room is None or nickname not in room['players']:
+        await send({'type': 'websocket.close', 'code': 1008, 'reason': "Not a player in this room"})
+        return
+    # asyncio already sets TCP_NODELAY on accepted sockets, so pushed boards
+    # are not held back by Nagle the way they were on the threaded server
+    await send({'type': 'websocket.accept'})
+
+    async def push_updates(since):
+        feed = room_feed(room, since)
+        try:
+            async for message in feed:
+                heartbeat(room_code, nickname)
+                if message is None:
+                    continue
+                version, payload, closed = message
+                await send({'type': 'websocket.send', 'text': payload})
+                if closed:
+                    break
+            await send({'type': 'websocket.close', 'code': 1000})
+        finally:
+            await feed.aclose()
+
+    pusher = asyncio.ensure_future(push_updates(request.int_arg('since')))
+    try:
+        while True:
+            message = await receive()
+            if message['type'] == 'websocket.disconnect':
+                break
+            reply, left = v12.room_command(room_code, nickname, message.get('text') or message.get('bytes'))
+            if reply:
+                await send({'type': 'websocket.send', 'text': reply})
+            if left:
+                break
+    finally:
+        pusher.cancel()
+        await asyncio.gather(pusher, return_exceptions=True)
+        if nickname in rooms.get(room_code, {}).get('players', ()):
+            heartbeat(room_code, nickname, v12.RECONNECT_GRACE)
+
+
+# uvicorn stops accepting on SIGTERM/SIGINT but then waits for open
+# connections; drain first so streams and long-polls close right away
+class Server(uvicorn.Server):
+    def handle_exit(self, sig, frame):
+        if loop is not None:
+            loop.call_soon_threadsafe(drain)
+        super().handle_exit(sig, frame)
+
+def serve(host="0.0.0.0", port=5000):
+    config = uvicorn.Config(app, host=host, port=port, backlog=4096, timeout_keep_alive=5,
+                            timeout_graceful_shutdown=v12.DRAIN_TIMEOUT, log_level="warning")
+    Server(config).run()
+
+if __name__ == "__main__":
+    print("🚀 Serving v12 on one event loop at http://0.0.0.0:5000")
+    serve()
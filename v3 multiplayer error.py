@@ -1,5 +1,4 @@
 import time
-import threading
 import socket
 import random
 from flask import Flask, render_template_string, request, redirect, url_for, session
@@ -257,5 +256,7 @@ def run_flask():
     print(f"🚀 Flask app running! Access it from your phone: http://{ip}:5000")
     app.run(host="0.0.0.0", port=5000)
 
-# Start Flask app in a separate thread
-threading.Thread(target=run_flask).start()
+# Serve from the main thread: a non-daemon server thread outlived the main
+# one, so Ctrl+C and SIGTERM could not stop the process
+if __name__ == "__main__":
+    run_flask()
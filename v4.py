@@ -1,8 +1,9 @@
 import time
-import threading
 import socket
+import secrets
 from flask import Flask, render_template_string, request, redirect, url_for, session
 import random
+from ratelimit import RateLimiter, too_many_requests
 
 # Initialize Flask app
 app = Flask(__name__)
@@ -131,8 +132,30 @@ def restart():
     session['game_state'] = initialize_game()  # Reset the game state
     return redirect(url_for('index'))  # Go back to the mode selection page after restart
 
+# Requests per second and burst each phone gets, by kind of request, so one
+# stuck tab can't take the server time of every other player
+limits = RateLimiter({
+    "poll": (2, 10),
+    "move": (4, 8),
+    "create": (0.2, 3),
+})
+endpoint_budgets = {'move': 'move', 'restart': 'move'}
+
+def request_budget():
+    if request.endpoint == 'index' and request.method == 'POST':
+        return 'create'
+    if request.endpoint == 'select_mode' and request.view_args.get('mode') == 'multiplayer':
+        return 'create'
+    return endpoint_budgets.get(request.endpoint, 'poll')
+
+# Rate limit by device and by session, then log
 @app.before_request
 def log_access():
+    if 'client' not in session:
+        session['client'] = secrets.token_hex(8)
+    wait = limits.check(request_budget(), (('ip', request.remote_addr), ('session', session['client'])))
+    if wait is not None:
+        return too_many_requests(wait)
     print(f"🌐 Access from: {request.remote_addr}")
 
 # HTML template for the nickname form
@@ -266,6 +289,7 @@ def run_flask():
     print(f"🚀 Flask app running! Access it from your phone: http://{ip}:5000")
     app.run(host="0.0.0.0", port=5000, debug=False)
 
-# Start Flask app in a separate thread
+# Serve from the main thread: a non-daemon server thread outlived the main
+# one, so Ctrl+C and SIGTERM could not stop the process
 if __name__ == "__main__":
-    threading.Thread(target=run_flask).start()
+    run_flask()
@@ -0,0 +1,88 @@
+import argparse
+import random
+import time
+
+from gamestate import GameState
+from state_bench import dict_state
+
+# Microbenchmark for move handling: random games played move by move as
+# apply_move() plays them, once on the dict board with the check_win() v12
+# used to have and once on GameState's bitboards. Both play the same games,
+# and must agree on how each one ended.
+#
+#   python win_bench.py --games 200000
+
+
+def check_win(game_state):
+    win_conditions = [
+        [0, 1, 2], [3, 4, 5], [6, 7, 8],
+        [0, 3, 6], [1, 4, 7], [2, 5, 8],
+        [0, 4, 8], [2, 4, 6]
+    ]
+    for condition in win_conditions:
+        if game_state["board"][condition[0]] == game_state["board"][condition[1]] == game_state["board"][condition[2]] != '':
+            game_state["game_over"] = True
+            winner = game_state["board"][condition[0]]
+            for player, symbol in game_state["symbols"].items():
+                if symbol == winner:
+                    game_state["result"] = f"{player} ({symbol}) wins!"
+                    break
+            return
+    if '' not in game_state["board"]:
+        game_state["game_over"] = True
+        game_state["result"] = "It's a draw!"
+
+def play_dicts(games, players):
+    results = []
+    moves = 0
+    for cells in games:
+        game_state = dict_state(players)
+        for cell in cells:
+            if game_state["game_over"]:
+                break
+            if game_state["board"][cell] != '':
+                continue
+            game_state["board"][cell] = game_state["current_turn"]
+            check_win(game_state)
+            moves += 1
+            if not game_state["game_over"]:
+                game_state["current_turn"] = 'O' if game_state["current_turn"] == 'X' else 'X'
+                game_state["current_player"] = [p for p in game_state["players"] if p != game_state["current_player"]][0]
+        results.append(game_state["result"])
+    return results, moves
+
+def play_bitboards(games, players):
+    results = []
+    moves = 0
+    for cells in games:
+        game_state = GameState(players)
+        for cell in cells:
+            if game_state.game_over:
+                break
+            if game_state.cell(cell):
+                continue
+            game_state.play(cell)
+            moves += 1
+        results.append(game_state.result)
+    return results, moves
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare moves per second of the bitboard engine and the old check_win()")
+    parser.add_argument('--games', type=int, default=200000)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    games = [rng.sample(range(9), 9) for _ in range(args.games)]
+    players = ["alice", "bob"]
+
+    outcomes = {}
+    print(f"{args.games} random games")
+    for label, play in [("check_win", play_dicts), ("bitboards", play_bitboards)]:
+        started = time.perf_counter()
+        outcomes[label], moves = play(games, players)
+        elapsed = time.perf_counter() - started
+        print(f"  {label:>9}: {moves / elapsed:>9.0f} moves/s  ({elapsed / moves * 1e6:.2f} us per move)")
+    if outcomes["check_win"] != outcomes["bitboards"]:
+        raise SystemExit("the two engines disagree on some games")
@@ -0,0 +1,203 @@
+import argparse
+import contextlib
+import http.cookiejar
+import json
+import random
+import re
+import socket
+import statistics
+import sys
+import threading
+import time
+import urllib.parse
+import urllib.request
+
+from websockets.exceptions import ConnectionClosed
+from websockets.sync.client import connect
+
+# Command-line WebSocket client for v12 rooms, so moves and pushes can be
+# exercised without a browser
+
+
+class Player:
+    def __init__(self, base_url, nickname):
+        self.base_url = base_url.rstrip('/')
+        self.nickname = nickname
+        self.room = None
+        self.ws = None
+        self.exits = contextlib.ExitStack()
+        self.state = None
+        self.received_bytes = 0
+        self.received_updates = 0
+        self.cookies = http.cookiejar.CookieJar()
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(self.cookies))
+        self.post('/', nickname=nickname)
+
+    def post(self, path, **form):
+        with self.opener.open(self.base_url + path, urllib.parse.urlencode(form).encode()) as response:
+            return response.read().decode()
+
+    def create_room(self):
+        self.post('/multiplayer', action='create')
+        self.room = self.view()['room']
+        return self.room
+
+    def view(self):
+        request = urllib.request.Request(self.base_url + '/game', headers={'Accept': 'application/json'})
+        with self.opener.open(request) as response:
+            return json.load(response)
+
+    def join_room(self, room):
+        page = self.post('/multiplayer', action='join', room_code=room)
+        if 'Room not found or full' in page:
+            raise SystemExit(f"Room {room} not found or full")
+        self.room = room
+
+    def connect(self):
+        url = re.sub(r'^http', 'ws', self.base_url) + f'/rooms/{self.room}/ws'
+        cookie = '; '.join(f'{c.name}={c.value}' for c in self.cookies)
+        # websockets keeps whatever arrives with the handshake response, like the
+        # snapshot v12_asgi pushes as soon as it accepts
+        self.ws = self.exits.enter_context(connect(url, additional_headers={'Cookie': cookie}, compression=None))
+        # Moves are tiny frames; Nagle would hold one back behind the last one's ACK
+        self.ws.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def send(self, **command):
+        self.ws.send(json.dumps(command))
+
+    # Returns the room state with the next pushed update folded in, or the
+    # server's error message
+    def receive(self, timeout=None):
+        try:
+            data = self.ws.recv(timeout)
+        except TimeoutError:
+            return None
+        message = json.loads(data)
+        if 'error' in message:
+            return message
+        self.received_bytes += len(data)
+        self.received_updates += 1
+        self.state = apply_update(self.state, message)
+        return self.state
+
+    def close(self):
+        self.exits.close()
+
+
+# Updates are either a snapshot (has "p") or deltas since our version; see
+# room_snapshot in v12.py for the keys
+def apply_update(state, update):
+    if 'p' in update:
+        return dict(update)
+    for delta in update['d']:
+        if 'c' in delta:
+            state['b'] = state['b'][:delta['c']] + delta['m'] + state['b'][delta['c'] + 1:]
+        for key in ('t', 'r', 'x'):
+            if key in delta:
+                state[key] = delta[key]
+    state['v'] = update['v']
+    return state
+
+
+def format_board(board):
+    cells = [c if c != ' ' else '.' for c in board]
+    return '\n'.join(' '.join(cells[row:row + 3]) for row in range(0, 9, 3))
+
+
+def interactive(args):
+    player = Player(args.url, args.nickname)
+    if args.join:
+        player.join_room(args.join)
+    else:
+        print(f"Room code: {player.create_room()}")
+    player.connect()
+
+    def print_updates():
+        while True:
+            try:
+                message = player.receive()
+            except ConnectionClosed:
+                print("Connection closed")
+                return
+            if 'error' in message:
+                print(f"! {message['error']}")
+            elif 'x' in message:
+                print(message.get('r', "Room closed"))
+            elif 'b' in message:
+                print(f"\n[v{message['v']}] turn: {message['t']}")
+                print(format_board(message['b']))
+                if 'r' in message:
+                    print(message['r'])
+            else:
+                print(f"[v{message['v']}] waiting for an opponent...")
+
+    threading.Thread(target=print_updates, daemon=True).start()
+    print("Commands: move <0-8> | restart | exit")
+    for line in sys.stdin:
+        words = line.split()
+        if not words:
+            continue
+        if words[0] == 'move' and len(words) == 2 and words[1].isdigit():
+            player.send(action='move', cell=int(words[1]))
+        elif words[0] in ('restart', 'exit'):
+            player.send(action=words[0])
+            if words[0] == 'exit':
+                break
+        else:
+            print("Commands: move <0-8> | restart | exit")
+    player.close()
+
+
+# Two seats play random games against each other and time each move from
+# the mover's send until the opponent receives the new board
+def bench(args):
+    host = Player(args.url, 'bench-x')
+    guest = Player(args.url, 'bench-o')
+    guest.join_room(host.create_room())
+    host.connect()
+    guest.connect()
+    seats = {host.nickname: host, guest.nickname: guest}
+    state = host.receive()
+    guest.receive()
+
+    latencies = []
+    started = time.perf_counter()
+    for _ in range(args.games):
+        while 'r' not in state:
+            mover = seats[state['t']]
+            opponent = guest if mover is host else host
+            cell = random.choice([i for i, mark in enumerate(state['b']) if mark == ' '])
+            sent = time.perf_counter()
+            mover.send(action='move', cell=cell)
+            state = opponent.receive()
+            latencies.append(time.perf_counter() - sent)
+            mover.receive()
+        host.send(action='restart')
+        state = host.receive()
+        guest.receive()
+    elapsed = time.perf_counter() - started
+
+    host.send(action='exit')
+    guest.send(action='exit')
+    host.close()
+    guest.close()
+    latencies.sort()
+    print(f"{len(latencies)} moves in {elapsed:.2f}s ({len(latencies) / elapsed:.0f} moves/s)")
+    print(f"move-to-opponent latency: p50 {statistics.median(latencies) * 1000:.2f} ms, "
+          f"p99 {latencies[int(len(latencies) * 0.99)] * 1000:.2f} ms, "
+          f"max {latencies[-1] * 1000:.2f} ms")
+    print(f"{(host.received_bytes + guest.received_bytes) / (host.received_updates + guest.received_updates):.0f} bytes per pushed update")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="WebSocket test client for v12 multiplayer rooms")
+    parser.add_argument('--url', default='http://127.0.0.1:5000')
+    parser.add_argument('--nickname', default='cli')
+    parser.add_argument('--join', metavar='CODE', help="join an existing room instead of creating one")
+    parser.add_argument('--bench', action='store_true', help="play random games between two seats and report latency")
+    parser.add_argument('--games', type=int, default=50)
+    args = parser.parse_args()
+    if args.bench:
+        bench(args)
+    else:
+        interactive(args)